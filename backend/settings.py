@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 
 
 
@@ -145,6 +146,11 @@ import dj_database_url
 database_url = os.environ.get("DATABASE_URL")
 
 DATABASES['default'] = dj_database_url.parse(database_url)
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # The threaded cart tests need a file: in-memory SQLite shared between
+    # connections fails with "table is locked" instead of waiting.
+    # Kept out of the checkout, in the system temp directory.
+    DATABASES['default']['TEST'] = {'NAME': Path(tempfile.gettempdir()) / 'ecom_test_db.sqlite3'}
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -201,6 +207,35 @@ FLUTTER_HASH_SECRET  = os.environ.get("FLUTTER_HASH_SECRET", "flw_8xT93hsd9Yz")
 
 PAYSTACK_SECRET_KEY = 'sk_test_56d554a2402c9bbccaf49c0c1c1a8ae90dd85820'
 
+PRODUCT_PAGE_SIZE = int(os.environ.get("PRODUCT_PAGE_SIZE", 24))
+PRODUCT_MAX_PAGE_SIZE = int(os.environ.get("PRODUCT_MAX_PAGE_SIZE", 100))
+
+CATALOG_CACHE_MAX_ENTRIES = int(os.environ.get("CATALOG_CACHE_MAX_ENTRIES", 1024))
+CATALOG_CACHE_TTL = int(os.environ.get("CATALOG_CACHE_TTL", 300))
+PRODUCT_EXPORT_CHUNK_SIZE = int(os.environ.get("PRODUCT_EXPORT_CHUNK_SIZE", 2000))
+PRODUCT_BATCH_MAX_SLUGS = int(os.environ.get("PRODUCT_BATCH_MAX_SLUGS", 100))
+RELATED_PRODUCTS_LIMIT = int(os.environ.get("RELATED_PRODUCTS_LIMIT", 8))
+CART_BATCH_MAX_OPS = int(os.environ.get("CART_BATCH_MAX_OPS", 100))
+
+# "database" writes every cart change through; "cache" buffers guest carts
+# (see core/cartstore.py for the consistency contract).
+CART_STORE = os.environ.get("CART_STORE", "database")
+CART_STORE_CACHE = os.environ.get("CART_STORE_CACHE", "default")
+CART_STORE_FLUSH_SECONDS = int(os.environ.get("CART_STORE_FLUSH_SECONDS", 300))
+CART_STORE_TTL = int(os.environ.get("CART_STORE_TTL", 7 * 24 * 3600))
+
+SUGGEST_LIMIT = int(os.environ.get("SUGGEST_LIMIT", 8))
+SUGGEST_MAX_LIMIT = int(os.environ.get("SUGGEST_MAX_LIMIT", 20))
+SUGGEST_REFRESH_SECONDS = int(os.environ.get("SUGGEST_REFRESH_SECONDS", 30))
+
+COUNTRY_REFRESH_SECONDS = int(os.environ.get("COUNTRY_REFRESH_SECONDS", 60))
+COUNTRY_CACHE_MAX_AGE = int(os.environ.get("COUNTRY_CACHE_MAX_AGE", 24 * 3600))
+
+# Guest carts and ships untouched for this long are removed by
+# `manage.py purge_stale_sessions`.
+PURGE_SESSIONS_AFTER_DAYS = int(os.environ.get("PURGE_SESSIONS_AFTER_DAYS", 30))
+PURGE_SESSIONS_BATCH_SIZE = int(os.environ.get("PURGE_SESSIONS_BATCH_SIZE", 1000))
+
  
 import cloudinary
 
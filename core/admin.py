@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Product, Cart, CartItem, TransactionFlutter, TransactionPaystack, Shipping, Ship, Country, Order
+from .models import Product, Cart, CartItem, TransactionFlutter, TransactionPaystack, Shipping, Ship, Country, Order, CacheVersion, ProductPair, ScanCheckpoint
 
 admin.site.register(Product)
 admin.site.register(Cart)
@@ -10,3 +10,6 @@ admin.site.register(Shipping)
 admin.site.register(Ship)
 admin.site.register(Country)
 admin.site.register(Order)
+admin.site.register(CacheVersion)
+admin.site.register(ProductPair)
+admin.site.register(ScanCheckpoint)
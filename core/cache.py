@@ -0,0 +1,114 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import CacheVersion
+
+CATALOG = 'catalog'
+
+
+def get_version(name=CATALOG):
+    """Return (version, updated_at) for a named data set, (0, None) if it never changed."""
+    row = CacheVersion.objects.filter(name=name).values_list('version', 'updated_at').first()
+    return row or (0, None)
+
+
+def catalog_state(request):
+    """Catalog (version, updated_at), read once per request and shared by the
+    conditional GET checks and the cache lookup."""
+    request = getattr(request, '_request', request)
+    if not hasattr(request, '_catalog_state'):
+        request._catalog_state = get_version(CATALOG)
+    return request._catalog_state
+
+
+def catalog_etag(request, *args, **kwargs):
+    version, _ = catalog_state(request)
+    representation = f"{version}:{request.build_absolute_uri()}:{request.META.get('HTTP_ACCEPT', '')}"
+    return hashlib.sha1(representation.encode()).hexdigest()
+
+
+def catalog_last_modified(request, *args, **kwargs):
+    _, updated_at = catalog_state(request)
+    return updated_at
+
+
+def bump_version(name=CATALOG):
+    # The version row lives in the database so every gunicorn worker sees the
+    # bump; their local caches drop stale entries on the next lookup.
+    updated = CacheVersion.objects.filter(name=name).update(version=F('version') + 1, updated_at=timezone.now())
+    if not updated:
+        CacheVersion.objects.get_or_create(name=name, defaults={'version': 1})
+
+
+def bump_version_on_commit(name=CATALOG):
+    # Bumping before commit would let another worker cache the old rows
+    # under the new version number.
+    transaction.on_commit(lambda: bump_version(name))
+
+
+class VersionedLRUCache:
+    """
+    Size-bounded LRU cache with a TTL, scoped to a data-set version.
+
+    Entries are only served while the version they were stored under is
+    current; seeing a newer version empties the cache.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, version, key):
+        with self._lock:
+            if version != self.version:
+                self._entries.clear()
+                self.version = version
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, version, key, value):
+        with self._lock:
+            if version != self.version:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'version': self.version,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+product_cache = VersionedLRUCache(settings.CATALOG_CACHE_MAX_ENTRIES, settings.CATALOG_CACHE_TTL)
@@ -0,0 +1,247 @@
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Cart, CartItem, CartItemRemoval, Product, TransactionFlutter, cart_totals
+
+CART_OPS = ('add', 'set', 'remove', 'delete')
+
+
+class CartOpsError(Exception):
+    def __init__(self, message, missing=None):
+        super().__init__(message)
+        self.message = message
+        self.missing = missing or []
+
+
+def parse_cart_ops(ops):
+    """Validate a list of {slug, op, quantity} operations; quantity defaults to 1."""
+    if not isinstance(ops, list) or not ops:
+        raise CartOpsError('ops must be a non-empty list')
+    if len(ops) > settings.CART_BATCH_MAX_OPS:
+        raise CartOpsError(f'at most {settings.CART_BATCH_MAX_OPS} ops per request')
+
+    parsed = []
+    for index, op in enumerate(ops):
+        if not isinstance(op, dict) or not isinstance(op.get('slug'), str) or not op['slug']:
+            raise CartOpsError(f'ops[{index}]: slug is required')
+        if op.get('op') not in CART_OPS:
+            raise CartOpsError(f'ops[{index}]: op must be one of {", ".join(CART_OPS)}')
+        try:
+            quantity = int(op.get('quantity', 1))
+        except (TypeError, ValueError):
+            raise CartOpsError(f'ops[{index}]: quantity must be an integer')
+        if quantity < 0 or (quantity == 0 and op['op'] != 'set'):
+            raise CartOpsError(f'ops[{index}]: quantity must be positive')
+        parsed.append((op['slug'], op['op'], quantity))
+    return parsed
+
+
+def resolve_products(slugs):
+    """Map slugs to product ids in one query, failing on any unknown slug."""
+    products = dict(Product.objects.filter(slug__in=set(slugs)).values_list('slug', 'id'))
+    missing = sorted(set(slugs) - products.keys())
+    if missing:
+        raise CartOpsError('unknown products', missing)
+    return products
+
+
+def fold_cart_ops(quantities, ops):
+    """
+    Apply (product_id, op, quantity) ops in order to a {product_id: quantity}
+    mapping, in place. add and set create missing items; set to 0, remove
+    down to 0 and delete leave None for the item.
+    """
+    for product_id, op, quantity in ops:
+        current = quantities.get(product_id)
+        if op == 'add':
+            quantities[product_id] = (current or 0) + quantity
+        elif op == 'set':
+            quantities[product_id] = quantity or None
+        elif op == 'remove' and current is not None:
+            quantities[product_id] = current - quantity if current > quantity else None
+        elif op == 'delete':
+            quantities[product_id] = None
+    return quantities
+
+
+def write_cart_items(cart, items, quantities, revision):
+    """
+    Bring the stored `items` ({product_id: CartItem}) in line with
+    `quantities`, with one query per kind of change, stamped with
+    `revision`. Returns whether anything was written.
+    """
+    created, updated, deleted = [], [], []
+    for product_id, quantity in quantities.items():
+        item = items.get(product_id)
+        if item is None:
+            if quantity:
+                created.append(CartItem(cart=cart, product_id=product_id, quantity=quantity))
+        elif quantity is None:
+            deleted.append(item)
+        elif quantity != item.quantity:
+            item.quantity = quantity
+            updated.append(item)
+
+    if not (created or updated or deleted):
+        return False
+
+    for item in created + updated:
+        item.revision = revision
+    CartItem.objects.bulk_create(created)
+    CartItem.objects.bulk_update(updated, ['quantity', 'revision'])
+    CartItem.objects.filter(pk__in=[item.pk for item in deleted]).delete()
+    CartItemRemoval.record(cart.pk, [item.product_id for item in deleted], revision)
+
+    # bulk writes skip CartItem.save(), which cancels a pending payment
+    # whose amount no longer matches the cart.
+    cancel_pending_payments(cart)
+    return True
+
+
+def lock_cart(cart):
+    """
+    Take the next revision of `cart` as the first statement of a
+    read-then-write transaction. The write locks the cart row before its
+    items are read: concurrent batches queue on it instead of both missing
+    a new item and inserting it twice (PostgreSQL), or failing to upgrade a
+    read lock with "database is locked" (SQLite).
+    """
+    return Cart.objects.next_revision(cart.pk)
+
+
+def apply_cart_ops(cart, ops, products=None):
+    """
+    Apply parsed ops to `cart` in order, atomically.
+
+    The ops are folded in memory first, so the database sees one query per
+    kind of change however many ops touch the same product. Unknown slugs
+    fail the whole batch before anything is written; pass `products` from
+    resolve_products() when the slugs were already checked.
+    """
+    if products is None:
+        products = resolve_products([slug for slug, _, _ in ops])
+
+    with transaction.atomic():
+        revision = lock_cart(cart)
+        items = {
+            item.product_id: item
+            for item in CartItem.objects.select_for_update().filter(cart=cart, product_id__in=products.values())
+        }
+        quantities = {product_id: item.quantity for product_id, item in items.items()}
+        fold_cart_ops(quantities, [(products[slug], op, quantity) for slug, op, quantity in ops])
+        write_cart_items(cart, items, quantities, revision)
+
+
+def sync_cart_items(cart, quantities):
+    """Make `cart` hold exactly `quantities` ({product_id: quantity}), atomically."""
+    with transaction.atomic():
+        revision = lock_cart(cart)
+        items = {item.product_id: item for item in CartItem.objects.select_for_update().filter(cart=cart)}
+        return write_cart_items(cart, items, {product_id: None for product_id in items} | quantities, revision)
+
+
+def cancel_pending_payments(cart):
+    TransactionFlutter.objects.filter(cart=cart, status='pending').update(status='canceled')
+
+
+def upsert_cart_item(cart, product, quantity, replace=False):
+    """
+    Add `quantity` of `product` to `cart`, or set it to `quantity` when
+    `replace` is true, in a single statement.
+
+    Concurrent calls for the same item all land: the increment happens in
+    the database and the unique (cart, product) row is resolved by the
+    conflict clause instead of get_or_create, which can race. Returns the
+    item as stored, with `product` attached.
+    """
+    if connection.vendor in ('sqlite', 'postgresql') and connection.features.can_return_columns_from_insert:
+        qn = connection.ops.quote_name
+        table = qn(CartItem._meta.db_table)
+        quantity_column = qn(CartItem._meta.get_field('quantity').column)
+        created_at = CartItem._meta.get_field('created_at').get_db_prep_save(timezone.now(), connection)
+        new_quantity = 'excluded.{0}' if replace else '{1}.{0} + excluded.{0}'
+        with transaction.atomic(), connection.cursor() as cursor:
+            revision = Cart.objects.next_revision(cart.pk)
+            cursor.execute(
+                f"INSERT INTO {table} ({qn('cart_id')}, {qn('product_id')}, {quantity_column}, {qn('created_at')}, {qn('revision')}) "
+                f"VALUES (%s, %s, %s, %s, %s) "
+                f"ON CONFLICT ({qn('cart_id')}, {qn('product_id')}) DO UPDATE "
+                f"SET {quantity_column} = {new_quantity.format(quantity_column, table)}, {qn('revision')} = excluded.{qn('revision')} "
+                f"RETURNING {qn('id')}, {quantity_column}",
+                [cart.pk, product.pk, quantity, created_at, revision],
+            )
+            pk, stored = cursor.fetchone()
+        return CartItem(pk=pk, cart=cart, product=product, quantity=stored, revision=revision)
+
+    # Other backends: an F() update, and an insert only when nothing matched.
+    with transaction.atomic():
+        revision = Cart.objects.next_revision(cart.pk)
+        items = CartItem.objects.filter(cart=cart, product=product)
+        if not items.update(quantity=quantity if replace else F('quantity') + quantity, revision=revision):
+            return CartItem.objects.create(cart=cart, product=product, quantity=quantity, revision=revision)
+        item = items.get()
+        item.product = product
+        return item
+
+
+def decrement_cart_item(cart, product, quantity):
+    """Take `quantity` of `product` out of `cart`, deleting the item when none would be left."""
+    with transaction.atomic():
+        items = CartItem.objects.filter(cart=cart, product=product)
+        revision = Cart.objects.next_revision(cart.pk)
+        if items.filter(quantity__lte=quantity).delete()[0]:
+            CartItemRemoval.record(cart.pk, [product.pk], revision)
+        else:
+            items.update(quantity=F('quantity') - quantity, revision=revision)
+
+
+def remove_cart_items(cart, product_ids=None):
+    """
+    Delete the items of `product_ids`, or every item, from `cart`, leaving
+    removal records for `GET /cart/?since=`. Returns how many were deleted.
+    """
+    with transaction.atomic():
+        items = CartItem.objects.filter(cart=cart)
+        if product_ids is not None:
+            items = items.filter(product_id__in=product_ids)
+        removed = list(items.values_list('product_id', flat=True))
+        if removed:
+            revision = Cart.objects.next_revision(cart.pk)
+            CartItem.objects.filter(cart=cart, product_id__in=removed).delete()
+            CartItemRemoval.record(cart.pk, removed, revision)
+    return len(removed)
+
+
+def parse_since(cart, tag):
+    """
+    The revision in `tag` if it is a revision tag this cart has had at the
+    current catalog version, else None. Once products have changed, item
+    payloads and totals the client holds may be stale, so it gets the full
+    cart again.
+    """
+    try:
+        cart_id, revision, catalog_version = (int(part) for part in str(tag).strip('"').split('.'))
+    except ValueError:
+        return None
+    if cart_id != cart.pk or catalog_version != cart.catalog_version:
+        return None
+    return revision if 0 <= revision <= cart.revision else None
+
+
+def cart_changes(cart, since):
+    """
+    Load onto `cart` what changed after revision `since`: the changed or
+    added items as `buffered_items`, the slugs of removed products as
+    `removed`, and the totals.
+    """
+    items = CartItem.objects.filter(cart=cart)
+    cart.buffered_items = list(items.filter(revision__gt=since).select_related('product'))
+    # A product removed and added back is reported as changed only.
+    cart.removed = list(CartItemRemoval.objects.filter(cart=cart, revision__gt=since).exclude(
+        product__in=items.values('product'),
+    ).values_list('product__slug', flat=True))
+    totals = items.aggregate(**cart_totals())
+    cart.total_items, cart.total_price = totals['total_items'], totals['total_price']
+    return cart
@@ -0,0 +1,181 @@
+"""
+Write-behind buffer for guest carts, enabled with CART_STORE = 'cache'.
+
+Guest cart changes go to the CART_STORE_CACHE cache instead of the
+database. Signed-in users' carts are always written straight through.
+
+Consistency contract:
+
+* The database is brought up to date, and is the only thing read, at every
+  point where money or identity is involved: the flutter checkout flushes
+  before pricing the cart, signing in flushes before merging the guest cart,
+  and a verified payment discards the buffer of the paid cart.
+* Any other change reaches the database on the first write made more than
+  CART_STORE_FLUSH_SECONDS after it, or when `manage.py flush_cart_store`
+  runs. Run that command at the same interval, so a crash or cache eviction
+  loses at most that window of guest cart edits. Carts are found through a
+  dirty index written only with the cache's atomic add and incr, so
+  concurrent workers cannot lose each other's marks.
+* A missing buffer (new, expired or evicted) is seeded from the database on
+  next use, so it falls back to the last flushed state.
+* Concurrent writes to the same guest cart are last-writer-wins, as with
+  any cache read-modify-write. Use a cache shared by all workers (Redis,
+  Memcached, database cache); the default LocMemCache is per-process and
+  only suits a single worker or tests.
+* Items of an unflushed cart have no database id yet, so their `id` is null
+  in responses. Clients address cart items by product slug.
+"""
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .carts import fold_cart_ops, sync_cart_items
+from .models import Cart, CartItem, Product, TransactionFlutter
+
+# The dirty index is a series of time buckets. A cart that becomes dirty
+# takes the next slot of the current bucket with an atomic incr; the flush
+# reads every bucket since the last one it finished, then drops the finished
+# ones.
+DIRTY_COUNT = 'cartstore:dirty:{bucket}'
+DIRTY_SLOT = 'cartstore:dirty:{bucket}:{slot}'
+DIRTY_SCANNED = 'cartstore:dirty:scanned'
+
+
+def cart_store_enabled():
+    return settings.CART_STORE == 'cache'
+
+
+def get_cache():
+    return caches[settings.CART_STORE_CACHE]
+
+
+def buffer_key(session_id):
+    return f'cartstore:{session_id}'
+
+
+class GuestCart:
+    """The buffered cart of one guest session."""
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.state = get_cache().get(buffer_key(session_id))
+        if self.state is None:
+            self.state = {
+                'items': dict(CartItem.objects.filter(
+                    cart__user=None, cart__session_id=session_id, cart__paid=False,
+                ).order_by('created_at', 'id').values_list('product_id', 'quantity')),
+                'changed_at': None,
+            }
+
+    @property
+    def quantities(self):
+        return self.state['items']
+
+    @property
+    def dirty(self):
+        return self.state['changed_at'] is not None
+
+    def apply(self, ops):
+        """Apply (product_id, op, quantity) ops, like carts.apply_cart_ops does for stored carts."""
+        quantities = fold_cart_ops(dict(self.quantities), ops)
+        self.state['items'] = {product_id: quantity for product_id, quantity in quantities.items() if quantity}
+        if not self.dirty:
+            self.state['changed_at'] = time.time()
+            mark_dirty(self.session_id)
+        if time.time() - self.state['changed_at'] >= settings.CART_STORE_FLUSH_SECONDS:
+            self.flush()
+        else:
+            self.save()
+
+    def save(self):
+        get_cache().set(buffer_key(self.session_id), self.state, settings.CART_STORE_TTL)
+
+    def flush(self):
+        """Write the buffered items to the guest's Cart rows."""
+        if self.dirty:
+            if self.quantities:
+                cart, _ = Cart.objects.get_or_create(user=None, session_id=self.session_id, paid=False)
+            else:
+                # An emptied buffer needs no cart row if there is none yet.
+                cart = Cart.objects.filter(user=None, session_id=self.session_id, paid=False).first()
+            if cart is not None:
+                sync_cart_items(cart, self.quantities)
+            self.state['changed_at'] = None
+        self.save()
+
+    def item(self, product):
+        """Unsaved CartItem for `product` as currently buffered, or None."""
+        quantity = self.quantities.get(product.pk)
+        return CartItem(product=product, quantity=quantity) if quantity else None
+
+    def as_cart(self):
+        """Unsaved Cart holding the buffered items, for BufferedCartSerializer."""
+        products = Product.objects.in_bulk(list(self.quantities))
+        cart = Cart(session_id=self.session_id)
+        # Newest first, like CartItem's default ordering
+        cart.buffered_items = [
+            CartItem(product=products[product_id], quantity=quantity)
+            for product_id, quantity in reversed(self.quantities.items())
+            if product_id in products
+        ]
+        cart.total_items = sum(item.quantity for item in cart.buffered_items)
+        cart.total_price = sum((item.product.price * item.quantity for item in cart.buffered_items), Decimal('0.00'))
+        # A checkout flushes the buffer first, so its payment is on the stored cart.
+        cart.pending_transactions = list(TransactionFlutter.objects.filter(
+            cart__user=None, cart__session_id=self.session_id, cart__paid=False, status='pending',
+        ).order_by('pk'))
+        return cart
+
+
+def dirty_bucket(timestamp):
+    return int(timestamp // max(settings.CART_STORE_FLUSH_SECONDS, 1))
+
+
+def mark_dirty(session_id):
+    cache = get_cache()
+    bucket = dirty_bucket(time.time())
+    count_key = DIRTY_COUNT.format(bucket=bucket)
+    cache.add(count_key, 0, settings.CART_STORE_TTL)
+    slot = cache.incr(count_key)
+    cache.set(DIRTY_SLOT.format(bucket=bucket, slot=slot), session_id, settings.CART_STORE_TTL)
+
+
+def flush_guest_cart(session_id):
+    if cart_store_enabled() and session_id:
+        GuestCart(session_id).flush()
+
+
+def discard_guest_cart(session_id):
+    """Drop the buffer, e.g. once its cart was paid or merged into a user's."""
+    if cart_store_enabled() and session_id:
+        # Its dirty index entry, if any, is skipped by the next flush.
+        get_cache().delete(buffer_key(session_id))
+
+
+def flush_dirty_carts():
+    """Flush every buffered guest cart with unwritten changes; returns how many were written."""
+    cache = get_cache()
+    now = time.time()
+    current = dirty_bucket(now)
+    first = cache.get(DIRTY_SCANNED) or dirty_bucket(now - settings.CART_STORE_TTL)
+    buckets = range(first, current + 1)
+    counts = cache.get_many([DIRTY_COUNT.format(bucket=bucket) for bucket in buckets])
+
+    flushed = 0
+    for bucket in buckets:
+        count = counts.get(DIRTY_COUNT.format(bucket=bucket)) or 0
+        slots = [DIRTY_SLOT.format(bucket=bucket, slot=slot) for slot in range(1, count + 1)]
+        for session_id in set(cache.get_many(slots).values()):
+            cart = GuestCart(session_id)
+            if cart.dirty:
+                cart.flush()
+                flushed += 1
+        if bucket < current - 1:
+            # Older buckets take no new marks, so a finished one can go. The
+            # previous bucket is kept a round longer for marks racing the
+            # bucket boundary.
+            cache.delete_many(slots + [DIRTY_COUNT.format(bucket=bucket)])
+            cache.set(DIRTY_SCANNED, bucket + 1, settings.CART_STORE_TTL)
+    return flushed
@@ -0,0 +1,71 @@
+import hashlib
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from rest_framework.renderers import JSONRenderer
+
+from .cache import get_version
+from .models import Country
+
+COUNTRY = 'country'
+
+# One immutable load of the table: the rendered `GET /country/` body, its
+# ETag, and the casefolded names and codes shipping addresses may use.
+CountrySnapshot = namedtuple('CountrySnapshot', ['version', 'body', 'etag', 'known'])
+
+
+def fold(value):
+    return ' '.join(str(value).split()).casefold()
+
+
+class CountryTable:
+    """
+    Process-local, read-only copy of the Country table.
+
+    Readers get a whole CountrySnapshot, replaced in one assignment on
+    reload, so they never see a half-loaded table. The country version is
+    re-checked at most every COUNTRY_REFRESH_SECONDS, and at once after a
+    save in this process.
+    """
+
+    def __init__(self):
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self.checked_at = 0.0
+
+    def load(self, version):
+        rows = list(Country.objects.order_by('country', 'id').values('id', 'country', 'country_code'))
+        body = JSONRenderer().render(rows)
+        known = frozenset(
+            fold(value) for row in rows for value in (row['country'], row['country_code']) if value
+        )
+        return CountrySnapshot(version, body, hashlib.sha1(body).hexdigest(), known)
+
+    def get(self):
+        now = time.monotonic()
+        snapshot = self._snapshot
+        if snapshot is not None and now - self.checked_at < settings.COUNTRY_REFRESH_SECONDS:
+            return snapshot
+        with self._lock:
+            # Another thread may have refreshed while this one waited.
+            if self._snapshot is not snapshot:
+                return self._snapshot
+            self.checked_at = now
+            version, _ = get_version(COUNTRY)
+            if snapshot is None or snapshot.version != version:
+                self._snapshot = self.load(version)
+            return self._snapshot
+
+    def invalidate(self):
+        self.checked_at = 0.0
+
+
+country_table = CountryTable()
+
+
+def is_known_country(value):
+    """True if `value` names or codes a stored country. Anything goes while the table is empty."""
+    known = country_table.get().known
+    return not known or fold(value) in known
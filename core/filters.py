@@ -1,12 +1,18 @@
 import django_filters
 from .models import Product
+from .search import search_products
 
 
 class SearchProductFilter(django_filters.FilterSet):
+    search = django_filters.CharFilter(method='filter_search')
+
     class Meta:
         model = Product
         fields = {
             'title': ['iexact', 'icontains'],
             'price': ['exact', 'lt', 'gt', 'range'],
             'category': ['iexact', 'icontains'],
-        }
\ No newline at end of file
+        }
+
+    def filter_search(self, queryset, name, value):
+        return search_products(queryset, value)
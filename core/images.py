@@ -0,0 +1,24 @@
+# Cloudinary transformations for the sizes the storefront renders. URLs are
+# pure string building (no API calls), done once when a Product is saved.
+IMAGE_VARIANTS = {
+    'thumb': {'width': 150, 'height': 150, 'crop': 'fill'},
+    'card': {'width': 400, 'height': 400, 'crop': 'fill'},
+    'full': {'width': 1200, 'crop': 'limit'},
+}
+
+
+def build_image_urls(image, field):
+    """
+    Return {'thumb', 'card', 'full', 'srcset'} URLs for a CloudinaryField
+    value, or None when the product has no image.
+    """
+    resource = field.to_python(image)
+    if not resource:
+        return None
+
+    urls = {
+        name: resource.build_url(secure=True, quality='auto', fetch_format='auto', **options)
+        for name, options in IMAGE_VARIANTS.items()
+    }
+    urls['srcset'] = ', '.join(f"{urls[name]} {options['width']}w" for name, options in IMAGE_VARIANTS.items())
+    return urls
@@ -0,0 +1,89 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import Product
+from core.search import search_products
+
+WORDS = (
+    'leather', 'silver', 'gold', 'cotton', 'denim', 'wireless', 'bluetooth', 'smart', 'classic', 'vintage',
+    'bag', 'watch', 'ring', 'necklace', 'shirt', 'jacket', 'speaker', 'headphones', 'charger', 'bracelet',
+    'red', 'black', 'white', 'blue', 'slim', 'large', 'mini', 'portable', 'premium', 'casual',
+)
+
+# Brand-like words that each appear in only a few products, so the benchmark
+# covers selective searches and misses as well as very common words.
+SYLLABLES = ('ka', 'lo', 'mi', 'ra', 'to', 'ne', 'vu', 'zi', 'po', 'sa')
+BRANDS = tuple(a + b + c + d for a in SYLLABLES for b in SYLLABLES for c in SYLLABLES for d in SYLLABLES[:5])
+
+
+class Command(BaseCommand):
+    help = 'Compare full-text product search latency with the old title__icontains scan.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[10_000, 100_000, 1_000_000])
+        parser.add_argument('--queries', type=int, default=50)
+        parser.add_argument('--page-size', type=int, default=24)
+        parser.add_argument('--batch-size', type=int, default=5_000)
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        terms = [self.fake_term(rng) for _ in range(options['queries'])]
+        page_size = options['page_size']
+
+        self.stdout.write(f"{'products':>10} {'icontains p50':>14} {'icontains p95':>14} {'fts p50':>10} {'fts p95':>10}")
+
+        # Everything is generated inside one transaction and rolled back, so the
+        # benchmark leaves the database as it found it.
+        with transaction.atomic():
+            created = 0
+            for size in sorted(options['sizes']):
+                while created < size:
+                    batch = min(options['batch_size'], size - created)
+                    Product.objects.bulk_create([
+                        self.fake_product(rng, created + i) for i in range(batch)
+                    ])
+                    created += batch
+
+                icontains = self.measure(terms, lambda term: list(
+                    Product.objects.filter(title__icontains=term).order_by('-created_at', '-id')[:page_size]
+                ))
+                fts = self.measure(terms, lambda term: list(
+                    search_products(Product.objects.all(), term).order_by('-search_rank', '-id')[:page_size]
+                ))
+                self.stdout.write(
+                    f'{size:>10} {icontains[0]:>12.2f}ms {icontains[1]:>12.2f}ms {fts[0]:>8.2f}ms {fts[1]:>8.2f}ms'
+                )
+
+            transaction.set_rollback(True)
+
+    def fake_term(self, rng):
+        kind = rng.random()
+        if kind < 0.25:
+            return ' '.join(rng.sample(WORDS, 2))
+        if kind < 0.75:
+            return rng.choice(BRANDS)
+        return rng.choice(BRANDS) + 'xq'
+
+    def fake_product(self, rng, n):
+        title = f'{rng.choice(BRANDS)} ' + ' '.join(rng.sample(WORDS, 2))
+        return Product(
+            title=title,
+            slug=f'bench-{n}',
+            price=Decimal(rng.randint(100, 100_000)) / 100,
+            category=rng.choice(Product.CATEGORY_CHOICES)[0],
+            description=' '.join(rng.choices(WORDS, k=20)),
+        )
+
+    def measure(self, terms, run):
+        timings = []
+        for term in terms:
+            start = time.perf_counter()
+            run(term)
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        return statistics.median(timings), timings[int(len(timings) * 0.95) - 1]
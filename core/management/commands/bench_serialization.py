@@ -0,0 +1,69 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from core.models import Product
+from core.serializer import ProductSerializer, product_values
+
+from .bench_search import WORDS
+
+
+class Command(BaseCommand):
+    help = 'Compare ProductSerializer with the values() serialization path on lists of products.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[1_000, 10_000, 100_000])
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--batch-size', type=int, default=5_000)
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        renderer = JSONRenderer()
+        queryset = Product.objects.order_by('-created_at', '-id')
+
+        self.stdout.write(f"{'rows':>10} {'serializer':>12} {'values':>12} {'speed-up':>9}")
+
+        # Generated inside one transaction and rolled back, like bench_search.
+        with transaction.atomic():
+            created = 0
+            for size in sorted(options['sizes']):
+                while created < size:
+                    batch = min(options['batch_size'], size - created)
+                    Product.objects.bulk_create([self.fake_product(rng, created + i) for i in range(batch)])
+                    created += batch
+
+                # Both timings cover the query, serialization and JSON rendering.
+                model = self.measure(options['repeat'], lambda: renderer.render(
+                    ProductSerializer(queryset[:size], many=True).data
+                ))
+                values = self.measure(options['repeat'], lambda: renderer.render(
+                    product_values.render(product_values.values(queryset[:size]))
+                ))
+                if model[1] != values[1]:
+                    raise CommandError(f'Outputs differ at {size} rows')
+                self.stdout.write(f'{size:>10} {model[0]:>10.1f}ms {values[0]:>10.1f}ms {model[0] / values[0]:>8.1f}x')
+
+            transaction.set_rollback(True)
+
+    def fake_product(self, rng, n):
+        return Product(
+            title=' '.join(rng.sample(WORDS, 3)),
+            slug=f'bench-{n}',
+            price=Decimal(rng.randint(100, 100_000)) / 100,
+            category=rng.choice(Product.CATEGORY_CHOICES)[0],
+            description=' '.join(rng.choices(WORDS, k=20)),
+            image=f'products/bench-{n}' if n % 2 else None,
+        )
+
+    def measure(self, repeat, run):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            output = run()
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings), output
@@ -0,0 +1,104 @@
+import time
+from collections import Counter
+from itertools import permutations
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from core.cache import CATALOG, bump_version
+from core.models import Order, Product, ProductPair, ScanCheckpoint
+
+CHECKPOINT = 'product_pairs'
+
+
+class Command(BaseCommand):
+    help = (
+        'Count how often products are bought together, reading only the completed orders '
+        'created since the previous run. Pass --rebuild to recount every order.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--rebuild', action='store_true', help='Drop all pairs and scan every order again.')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            with transaction.atomic():
+                ProductPair.objects.all().delete()
+                ScanCheckpoint.objects.filter(name=CHECKPOINT).delete()
+
+        scanned = pairs = 0
+        start = time.monotonic()
+        while True:
+            # Each batch commits together with the high-water mark, so an
+            # interrupted run resumes without counting an order twice.
+            with transaction.atomic():
+                checkpoint, _ = ScanCheckpoint.objects.select_for_update().get_or_create(name=CHECKPOINT)
+                orders = list(self.orders_after(checkpoint)[:options['batch_size']])
+                if not orders:
+                    break
+
+                counts = Counter()
+                for order in orders:
+                    counts.update(permutations(self.product_ids(order['products']), 2))
+                pairs += self.merge(counts)
+
+                checkpoint.last_created_at, checkpoint.last_id = orders[-1]['created_at'], orders[-1]['id']
+                checkpoint.save()
+
+            scanned += len(orders)
+            self.stdout.write(f'{scanned} orders scanned, {pairs} pair counts updated')
+
+        if pairs:
+            # Related product responses are cached under the catalog version.
+            bump_version(CATALOG)
+        self.stdout.write(self.style.SUCCESS(
+            f'Scanned {scanned} orders in {time.monotonic() - start:.1f}s, {pairs} pair counts updated'
+        ))
+
+    def orders_after(self, checkpoint):
+        # Orders are created once payment is verified, so every order past the
+        # mark is complete and none can later become complete behind it.
+        orders = Order.objects.filter(payment_status='completed')
+        if checkpoint.last_created_at is not None:
+            orders = orders.filter(
+                Q(created_at__gt=checkpoint.last_created_at)
+                | Q(created_at=checkpoint.last_created_at, id__gt=checkpoint.last_id)
+            )
+        return orders.order_by('created_at', 'id').values('id', 'created_at', 'products')
+
+    def product_ids(self, products):
+        ids = set()
+        for item in products if isinstance(products, list) else []:
+            if isinstance(item, dict) and isinstance(item.get('id'), int):
+                ids.add(item['id'])
+        return sorted(ids)
+
+    def merge(self, counts):
+        # Snapshots can name products that were deleted since.
+        product_ids = {product for pair in counts for product in pair}
+        existing_ids = set(Product.objects.filter(id__in=product_ids).values_list('id', flat=True))
+        counts = {pair: count for pair, count in counts.items() if pair[0] in existing_ids and pair[1] in existing_ids}
+        if not counts:
+            return 0
+
+        existing = ProductPair.objects.filter(
+            product_id__in={pair[0] for pair in counts},
+            companion_id__in={pair[1] for pair in counts},
+        )
+        updated, now = [], timezone.now()
+        for pair in existing:
+            added = counts.pop((pair.product_id, pair.companion_id), None)
+            if added:
+                pair.count += added
+                pair.updated_at = now
+                updated.append(pair)
+
+        ProductPair.objects.bulk_update(updated, ['count', 'updated_at'])
+        ProductPair.objects.bulk_create([
+            ProductPair(product_id=product, companion_id=companion, count=count)
+            for (product, companion), count in counts.items()
+        ])
+        return len(updated) + len(counts)
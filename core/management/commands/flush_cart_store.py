@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.cartstore import cart_store_enabled, flush_dirty_carts
+
+
+class Command(BaseCommand):
+    help = (
+        'Write buffered guest carts with unsaved changes to the database. Run it every '
+        'CART_STORE_FLUSH_SECONDS when CART_STORE is "cache".'
+    )
+
+    def handle(self, *args, **options):
+        if not cart_store_enabled():
+            raise CommandError('CART_STORE is not "cache"; there is nothing to flush')
+        self.stdout.write(self.style.SUCCESS(f'Flushed {flush_dirty_carts()} guest carts'))
@@ -0,0 +1,164 @@
+import csv
+import json
+import time
+from itertools import islice
+from pathlib import Path
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core.cache import CATALOG, bump_version
+from core.images import build_image_urls
+from core.models import Product, slug_base, slug_suffix
+
+IMPORT_FIELDS = ('title', 'slug', 'price', 'category', 'description', 'image')
+UPDATE_FIELDS = ('title', 'price', 'category', 'description', 'image', 'image_urls')
+IMAGE_FIELD = Product._meta.get_field('image')
+PRICE_FIELD = Product._meta.get_field('price')
+CATEGORIES = {key.lower(): key for key, _ in Product.CATEGORY_CHOICES} | {
+    label.lower(): key for key, label in Product.CATEGORY_CHOICES
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Stream products from a CSV or JSONL file into the catalog. Rows with a slug are '
+        'upserted on it; rows without one are inserted under a freshly generated unique slug.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'])
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.exists():
+            raise CommandError(f'{path} does not exist')
+        fmt = options['format'] or ('csv' if path.suffix.lower() == '.csv' else 'jsonl')
+
+        imported = skipped = 0
+        start = time.monotonic()
+
+        with path.open(newline='', encoding='utf-8') as handle:
+            rows = self.read_csv(handle) if fmt == 'csv' else self.read_jsonl(handle)
+            while True:
+                chunk = list(islice(rows, options['batch_size']))
+                if not chunk:
+                    break
+
+                products, columns, errors = self.build(chunk)
+                skipped += len(errors)
+                for error in errors:
+                    self.stderr.write(error)
+
+                with transaction.atomic():
+                    self.assign_slugs(products)
+                    self.write(products, columns)
+
+                imported += len(products)
+                elapsed = time.monotonic() - start
+                self.stdout.write(f'{imported} imported, {skipped} skipped ({imported / elapsed:.0f} rows/s)')
+
+        # bulk_create does not send post_save, so invalidate catalog caches here.
+        bump_version(CATALOG)
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {imported} products in {elapsed:.1f}s, {skipped} rows skipped'
+        ))
+
+    def read_csv(self, handle):
+        for line, row in enumerate(csv.DictReader(handle), start=2):
+            yield line, row
+
+    def read_jsonl(self, handle):
+        for line, text in enumerate(handle, start=1):
+            if not text.strip():
+                continue
+            try:
+                yield line, json.loads(text)
+            except json.JSONDecodeError as error:
+                yield line, error
+
+    def build(self, chunk):
+        by_slug, unslugged, columns, errors = {}, [], set(), []
+
+        for line, row in chunk:
+            if not isinstance(row, dict):
+                errors.append(f'line {line}: {row}')
+                continue
+
+            # The field's own checks catch NaN and too many digits, which
+            # would otherwise fail the whole chunk's INSERT.
+            try:
+                price = PRICE_FIELD.clean(str(row.get('price', '')).strip(), None)
+            except ValidationError as error:
+                errors.append(f'line {line}: invalid price {row.get("price")!r}: {" ".join(error.messages)}')
+                continue
+            if price < 0:
+                errors.append(f'line {line}: negative price {row.get("price")!r}')
+                continue
+
+            category = (row.get('category') or '').strip()
+            if category and category.lower() not in CATEGORIES:
+                errors.append(f'line {line}: unknown category {category!r}')
+                continue
+
+            columns.update(field for field in IMPORT_FIELDS if field in row)
+            product = Product(
+                title=row.get('title') or None,
+                slug=(row.get('slug') or '').strip(),
+                price=price,
+                category=CATEGORIES.get(category.lower()) if category else None,
+                description=row.get('description') or None,
+                # Stored as the Cloudinary public id; URLs are only built when
+                # the product is read, so nothing is uploaded here.
+                image=row.get('image') or None,
+            )
+            product.image_urls = build_image_urls(product.image, IMAGE_FIELD)
+
+            # A slug repeated within one batch keeps its last row, as a
+            # sequence of single-row upserts would.
+            if product.slug:
+                by_slug.pop(product.slug, None)
+                by_slug[product.slug] = product
+            else:
+                unslugged.append(product)
+
+        return list(by_slug.values()) + unslugged, columns, errors
+
+    def assign_slugs(self, products):
+        pending = [product for product in products if not product.slug]
+        taken = {product.slug for product in products if product.slug}
+        for product in pending:
+            product.slug = slug_base(product.title)
+
+        # One query per round; a round only repeats for the few slugs whose
+        # random suffix also collided.
+        while pending:
+            candidates = [product.slug for product in pending]
+            taken |= set(Product.objects.filter(slug__in=candidates).values_list('slug', flat=True))
+
+            retry = []
+            for product in pending:
+                if product.slug in taken:
+                    product.slug = f'{slug_base(product.title)}-{slug_suffix()}'
+                    retry.append(product)
+                else:
+                    taken.add(product.slug)
+            pending = retry
+
+    def write(self, products, columns):
+        if 'image' in columns:
+            columns.add('image_urls')
+        update_fields = [field for field in UPDATE_FIELDS if field in columns]
+        if update_fields:
+            Product.objects.bulk_create(
+                products,
+                update_conflicts=True,
+                unique_fields=['slug'],
+                update_fields=update_fields,
+            )
+        else:
+            Product.objects.bulk_create(products, ignore_conflicts=True)
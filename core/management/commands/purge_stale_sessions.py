@@ -0,0 +1,46 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.purge import purge_stale_sessions
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete unpaid guest carts and orphaned guest ships untouched for PURGE_SESSIONS_AFTER_DAYS, '
+        'and cancel payments left pending as long. Safe to run as a periodic job.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.PURGE_SESSIONS_AFTER_DAYS)
+        parser.add_argument('--batch-size', type=int, default=settings.PURGE_SESSIONS_BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would be purged.')
+
+    def handle(self, *args, **options):
+        if options['days'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--days and --batch-size must be positive')
+        self.verbosity = options['verbosity']
+        cutoff = timezone.now() - timedelta(days=options['days'])
+
+        start = time.monotonic()
+        counts = purge_stale_sessions(
+            cutoff, options['batch_size'], options['dry_run'],
+            progress=None if options['dry_run'] else self.progress,
+        )
+        elapsed = time.monotonic() - start
+
+        verb = 'Would purge' if options['dry_run'] else 'Purged'
+        for label, count in counts.items():
+            self.stdout.write(f'{label}: {count}')
+        total = sum(counts.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {total} rows older than {cutoff:%Y-%m-%d %H:%M} in {elapsed:.1f}s '
+            f'({total / elapsed if elapsed else 0:.0f} rows/s)'
+        ))
+
+    def progress(self, counts):
+        if self.verbosity > 1:
+            self.stdout.write(', '.join(f'{label}: {count}' for label, count in counts.items()))
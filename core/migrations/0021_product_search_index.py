@@ -0,0 +1,22 @@
+from django.db import migrations
+
+from core import search
+
+
+def install_index(apps, schema_editor):
+    search.install_index(schema_editor)
+
+
+def uninstall_index(apps, schema_editor):
+    search.uninstall_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_product_created_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_index, uninstall_index),
+    ]
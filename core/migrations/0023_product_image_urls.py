@@ -0,0 +1,34 @@
+# Generated by Django 5.1.6 on 2026-10-18 19:51
+
+from django.db import migrations, models
+
+from core.images import build_image_urls
+
+
+def backfill_image_urls(apps, schema_editor):
+    Product = apps.get_model('core', 'Product')
+    field = Product._meta.get_field('image')
+    batch = []
+    for product in Product.objects.exclude(image=None).exclude(image='').only('id', 'image').iterator(chunk_size=500):
+        product.image_urls = build_image_urls(product.image, field)
+        batch.append(product)
+        if len(batch) == 500:
+            Product.objects.bulk_update(batch, ['image_urls'])
+            batch = []
+    Product.objects.bulk_update(batch, ['image_urls'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_cacheversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='image_urls',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_image_urls, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.1.6 on 2026-10-18 19:52
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_product_image_urls'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['user', 'session_id', 'paid'], name='cart_owner_paid_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', '-created_at', '-id'], name='product_category_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ship',
+            index=models.Index(fields=['session_id'], name='ship_session_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shipping',
+            index=models.Index(fields=['ship', 'selected'], name='shipping_ship_selected_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transactionflutter',
+            index=models.Index(fields=['cart', 'status'], name='txflutter_cart_status_idx'),
+        ),
+    ]
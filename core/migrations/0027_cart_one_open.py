@@ -0,0 +1,58 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:50
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fold_duplicate_open_carts(apps, schema_editor):
+    """
+    Before the constraints, an owner could end up with several open carts;
+    only the lowest id was ever served. Move the others' items into it
+    (summing quantities) and detach the emptied carts from their owner so
+    purge_stale_sessions can reclaim them. Payments and orders stay put.
+    """
+    Cart = apps.get_model('core', 'Cart')
+    CartItem = apps.get_model('core', 'CartItem')
+    open_carts = Cart.objects.filter(paid=False)
+
+    def duplicated(field, carts):
+        return carts.order_by().values(field).annotate(n=Count('id')).filter(n__gt=1).values_list(field, flat=True)
+
+    def fold(carts):
+        kept, *extras = carts.order_by('pk')
+        quantities = dict(CartItem.objects.filter(cart=kept).values_list('product_id', 'quantity'))
+        for item in CartItem.objects.filter(cart__in=extras).order_by('pk'):
+            if item.product_id in quantities:
+                quantities[item.product_id] += item.quantity
+                CartItem.objects.filter(cart=kept, product_id=item.product_id).update(quantity=quantities[item.product_id])
+                item.delete()
+            else:
+                quantities[item.product_id] = item.quantity
+                CartItem.objects.filter(pk=item.pk).update(cart=kept)
+        Cart.objects.filter(pk__in=[cart.pk for cart in extras]).update(user=None, session_id=None)
+
+    for session_id in list(duplicated('session_id', open_carts.filter(user=None).exclude(session_id=None))):
+        fold(open_carts.filter(user=None, session_id=session_id))
+    for user_id in list(duplicated('user', open_carts.exclude(user=None))):
+        fold(open_carts.filter(user_id=user_id))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0026_cart_revision'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(fold_duplicate_open_carts, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cart',
+            constraint=models.UniqueConstraint(condition=models.Q(('paid', False), ('user__isnull', True)), fields=('session_id',), name='cart_one_open_per_session'),
+        ),
+        migrations.AddConstraint(
+            model_name='cart',
+            constraint=models.UniqueConstraint(condition=models.Q(('paid', False), ('user__isnull', False)), fields=('user',), name='cart_one_open_per_user'),
+        ),
+    ]
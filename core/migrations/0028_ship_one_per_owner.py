@@ -0,0 +1,55 @@
+# Generated by Django 5.1.6 on 2026-10-18 21:04
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fold_duplicate_ships(apps, schema_editor):
+    """
+    Before the constraints, an owner could end up with several ships; only
+    the lowest id was ever served. Move the others' addresses onto it and
+    delete them. The kept ship's default and selected addresses stay so;
+    moved addresses only bring a flag the kept ship lacks.
+    """
+    Ship = apps.get_model('core', 'Ship')
+    Shipping = apps.get_model('core', 'Shipping')
+
+    def duplicated(field, ships):
+        return ships.order_by().values(field).annotate(n=Count('id')).filter(n__gt=1).values_list(field, flat=True)
+
+    def fold(ships):
+        kept, *extras = ships.order_by('pk')
+        moved = Shipping.objects.filter(ship__in=extras)
+        for flag in ('default', 'selected'):
+            flagged = Shipping.objects.filter(ship=kept, **{flag: True}).exists()
+            # At most one moved address keeps the flag, the most recent.
+            keep = None if flagged else moved.filter(**{flag: True}).order_by('-created_at', '-pk').values_list('pk', flat=True).first()
+            moved.filter(**{flag: True}).exclude(pk=keep).update(**{flag: False})
+        moved.update(ship=kept)
+        Ship.objects.filter(pk__in=[ship.pk for ship in extras]).delete()
+
+    for session_id in list(duplicated('session_id', Ship.objects.filter(user=None).exclude(session_id=None))):
+        fold(Ship.objects.filter(user=None, session_id=session_id))
+    for user_id in list(duplicated('user', Ship.objects.exclude(user=None))):
+        fold(Ship.objects.filter(user_id=user_id))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0027_cart_one_open'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(fold_duplicate_ships, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='ship',
+            constraint=models.UniqueConstraint(condition=models.Q(('user__isnull', True)), fields=('session_id',), name='ship_one_per_session'),
+        ),
+        migrations.AddConstraint(
+            model_name='ship',
+            constraint=models.UniqueConstraint(condition=models.Q(('user__isnull', False)), fields=('user',), name='ship_one_per_user'),
+        ),
+    ]
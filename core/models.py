@@ -1,14 +1,95 @@
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import F, Q, Sum, Value
+from django.db.models.functions import Coalesce
 from django.conf import settings
 import secrets
 import string
 from cloudinary.models import CloudinaryField
+from django.utils import timezone
+from django.utils.functional import cached_property
 from django.utils.text import slugify
 from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import UploadedFile
 from decimal import Decimal
+from .images import build_image_urls
 
 User = get_user_model()
 
+PRICE_TOTAL = models.DecimalField(max_digits=12, decimal_places=2)
+
+
+def slug_base(title):
+    return slugify(title or '')[:240] or 'product'
+
+
+def slug_suffix(length=6):
+    alphabet = string.ascii_lowercase + string.digits
+    return ''.join(secrets.choice(alphabet) for _ in range(length))
+
+
+class DirtyFieldsMixin:
+    """
+    Remembers the column values an instance was loaded or last saved with.
+
+    `save()` on a loaded instance writes only the columns that changed, plus
+    auto_now fields, and subclasses can ask `has_changed()` instead of
+    reading the old row back.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot()
+        return instance
+
+    def _snapshot(self):
+        deferred = self.get_deferred_fields()
+        self._loaded_values = {
+            field.attname: getattr(self, field.attname)
+            for field in self._meta.concrete_fields
+            if field.attname not in deferred
+        }
+
+    def has_changed(self, *names):
+        """True if any of the named fields differs from the stored row, or the row is unknown."""
+        loaded = getattr(self, '_loaded_values', None)
+        if self._state.adding or loaded is None:
+            return True
+        for name in names:
+            attname = self._meta.get_field(name).attname
+            if attname not in loaded or getattr(self, attname) != loaded[attname]:
+                return True
+        return False
+
+    def get_dirty_fields(self):
+        loaded = getattr(self, '_loaded_values', None) or {}
+        return [
+            field.name for field in self._meta.concrete_fields
+            if field.attname in loaded and getattr(self, field.attname) != loaded[field.attname]
+        ]
+
+    def narrowed_update_fields(self, args, kwargs):
+        """The columns a save() with these arguments writes, or None for a full save."""
+        narrow = (
+            not self._state.adding
+            and getattr(self, '_loaded_values', None) is not None
+            and kwargs.get('update_fields') is None
+            and not kwargs.get('force_insert')
+            and not args
+        )
+        if not narrow:
+            return None
+        auto_now = [field.name for field in self._meta.concrete_fields if getattr(field, 'auto_now', False)]
+        return self.get_dirty_fields() + auto_now
+
+    def save(self, *args, **kwargs):
+        update_fields = self.narrowed_update_fields(args, kwargs)
+        if update_fields is not None:
+            # An empty list makes Django skip the write entirely.
+            kwargs['update_fields'] = update_fields
+        super().save(*args, **kwargs)
+        self._snapshot()
+
 
 class Product(models.Model):
     CATEGORY_CHOICES = (
@@ -21,48 +102,166 @@ class Product(models.Model):
     slug = models.SlugField(max_length=255, unique=True, blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     image = CloudinaryField('image_ecommerce', blank=True, null=True)
+    image_urls = models.JSONField(blank=True, null=True, editable=False)
     category = models.CharField(max_length=255, choices=CATEGORY_CHOICES, blank=True, null=True)
     description = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True, blank=True, null=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='product_created_id_idx'),
+            models.Index(fields=['category', '-created_at', '-id'], name='product_category_created_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.slug and self.title:
-            self.slug = slugify(self.title)
+            slug = slug_base(self.title)
+            while Product.objects.filter(slug=slug).exists():
+                slug = f'{slug_base(self.title)}-{slug_suffix()}'
+            self.slug = slug
+        field = self._meta.get_field('image')
+        uploading = isinstance(self.image, UploadedFile)
+        if not uploading:
+            self.image_urls = build_image_urls(self.image, field)
         super().save(*args, **kwargs)
+        if uploading:
+            # CloudinaryField.pre_save has uploaded the file and put the
+            # stored resource in its place, so the URLs can be built now.
+            self.image_urls = build_image_urls(self.image, field)
+            Product.objects.filter(pk=self.pk).update(image_urls=self.image_urls)
 
     def __str__(self):
         return self.title if self.title else None
 
-class Cart(models.Model):
+def cart_prefetches():
+    """What CartSerializer reads besides the cart row itself."""
+    return [
+        'cartitem__product',
+        models.Prefetch(
+            'transactionflutter',
+            queryset=TransactionFlutter.objects.filter(status='pending').order_by('pk'),
+            to_attr='pending_transactions',
+        ),
+    ]
+
+
+def cart_totals(prefix=''):
+    """total_items and total_price expressions over cart items reached through `prefix`."""
+    return {
+        'total_items': Coalesce(Sum(f'{prefix}quantity'), 0),
+        'total_price': Coalesce(
+            Sum(F(f'{prefix}quantity') * F(f'{prefix}product__price'), output_field=PRICE_TOTAL),
+            Value(Decimal('0.00')),
+            output_field=PRICE_TOTAL,
+        ),
+    }
+
+
+class CartQuerySet(models.QuerySet):
+    def with_totals(self):
+        """
+        Annotate item and price totals in the database and prefetch items,
+        products and the pending payment, so serializing any number of carts
+        takes a fixed number of queries.
+        """
+        return self.annotate(**cart_totals('cartitem__')).prefetch_related(*cart_prefetches())
+
+    def next_revision(self, cart_id):
+        """
+        Bump the revision of cart `cart_id` and return the new value. Every
+        write to a cart's items or payment link goes through here, so ETags
+        and `GET /cart/?since=` see it.
+        """
+        now = timezone.now()
+        if connection.vendor in ('sqlite', 'postgresql') and connection.features.can_return_columns_from_insert:
+            # One statement; the same backends take UPDATE ... RETURNING.
+            qn = connection.ops.quote_name
+            updated_at = self.model._meta.get_field('updated_at').get_db_prep_save(now, connection)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"UPDATE {qn(self.model._meta.db_table)} SET {qn('revision')} = {qn('revision')} + 1, "
+                    f"{qn('updated_at')} = %s WHERE {qn('id')} = %s RETURNING {qn('revision')}",
+                    [updated_at, cart_id],
+                )
+                return cursor.fetchone()[0]
+
+        # No savepoint: callers bump inside their own write transaction.
+        with transaction.atomic(savepoint=False):
+            self.filter(pk=cart_id).update(revision=F('revision') + 1, updated_at=now)
+            return self.filter(pk=cart_id).values_list('revision', flat=True).get()
+
+
+class Cart(DirtyFieldsMixin, models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
     session_id = models.CharField(max_length=255, null=True, blank=True)
     paid = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True, blank=True, null=True)
     updated_at = models.DateTimeField(auto_now=True)
+    revision = models.PositiveBigIntegerField(default=0)
+
+    objects = CartQuerySet.as_manager()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'session_id', 'paid'], name='cart_owner_paid_idx'),
+        ]
+        # One open cart per owner, so concurrent first writes cannot fork it.
+        constraints = [
+            models.UniqueConstraint(
+                fields=['session_id'], condition=Q(user__isnull=True, paid=False), name='cart_one_open_per_session',
+            ),
+            models.UniqueConstraint(
+                fields=['user'], condition=Q(user__isnull=False, paid=False), name='cart_one_open_per_user',
+            ),
+        ]
+
+    # The totals and pending_transactions set by CartQuerySet.with_totals()
+    # are used when present.
     def get_total_items(self):
+        if hasattr(self, 'total_items'):
+            return self.total_items
         total_quantity = sum(item.quantity for item in self.cartitem.all())
         return total_quantity
     
     def get_total_price(self):
+        if hasattr(self, 'total_price'):
+            return self.total_price
         total_price = sum(item.get_price for item in self.cartitem.all())
         return total_price
     
     def get_flutter_link(self):
-        transaction = self.transactionflutter.filter(status="pending").first()
+        if hasattr(self, 'pending_transactions'):
+            transaction = self.pending_transactions[0] if self.pending_transactions else None
+        else:
+            transaction = self.transactionflutter.filter(status="pending").first()
         return transaction.link if transaction else None
     
+    @cached_property
+    def catalog_version(self):
+        """
+        Catalog version the cart is served at. Product edits (prices, titles,
+        images) change the cart's payload without touching its revision.
+        Views that already read the version assign it instead.
+        """
+        from .cache import CATALOG, get_version
+        return get_version(CATALOG)[0]
+
+    @property
+    def revision_tag(self):
+        """Opaque version of the cart contents, sent as its ETag and taken back by `?since=`."""
+        return f'{self.pk}.{self.revision}.{self.catalog_version}' if self.pk else None
+
     def __str__(self):
             return f"username:{self.user.username} - cart:{self.id}" if self.user else f"session_id: {self.session_id} - cart:{self.id}" 
 
-class CartItem(models.Model):
+class CartItem(DirtyFieldsMixin, models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='cartitem')
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='product')
     quantity = models.PositiveBigIntegerField(default=1)
     created_at = models.DateTimeField(auto_now_add=True, blank=True, null=True)
+    # Cart revision of the last change to this item
+    revision = models.PositiveBigIntegerField(default=0)
 
     class Meta:
         unique_together = ('cart', 'product')
@@ -73,29 +272,65 @@ class CartItem(models.Model):
         return (self.product.price * self.quantity) if self.product else None
 
     def save(self, *args, **kwargs):
-        if self.id:
-            old = CartItem.objects.get(id=self.id)
-            # Only cancel if quantity or product changed
-            if old.quantity != self.quantity or old.product != self.product:
-                transaction = self.cart.transactionflutter.first()
-                if transaction and transaction.status == "pending":
-                    transaction.status = "canceled"
-                    transaction.save(update_fields=["status"])
+        # Only cancel if quantity or product changed
+        if self.id and self.has_changed('quantity', 'product'):
+            TransactionFlutter.objects.filter(cart_id=self.cart_id, status="pending").update(status="canceled")
+        if self.has_changed('quantity', 'product'):
+            # The write paths in core.carts stamp the revision themselves
+            stamped = self.revision if self._state.adding else self.has_changed('revision')
+            if not stamped:
+                self.revision = Cart.objects.next_revision(self.cart_id)
         super().save(*args, **kwargs)
 
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            CartItemRemoval.record(self.cart_id, [self.product_id], Cart.objects.next_revision(self.cart_id))
+            return super().delete(*args, **kwargs)
+
 
     def __str__(self):
         return f'{self.quantity} quantity of {self.product.title} in cart with {f'username: {self.cart.user}' if self.cart.user else f'session_id: {self.cart.session_id}'}'
 
+class CartItemRemoval(models.Model):
+    # Tombstone of a product taken out of a cart, so `GET /cart/?since=`
+    # can report removals. One row per cart and product, at the latest
+    # removal.
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='removals')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    revision = models.PositiveBigIntegerField()
+
+    class Meta:
+        unique_together = ('cart', 'product')
+
+    @classmethod
+    def record(cls, cart_id, product_ids, revision):
+        cls.objects.bulk_create(
+            [cls(cart_id=cart_id, product_id=product_id, revision=revision) for product_id in product_ids],
+            update_conflicts=True, unique_fields=['cart', 'product'], update_fields=['revision'],
+        )
+
+    def __str__(self):
+        return f"product {self.product_id} removed from cart {self.cart_id} at {self.revision}"
+
 class Ship(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='ships')
     session_id = models.CharField(max_length=255, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['session_id'], name='ship_session_idx'),
+        ]
+        # One ship per owner, so concurrent first addresses cannot fork it.
+        constraints = [
+            models.UniqueConstraint(fields=['session_id'], condition=Q(user__isnull=True), name='ship_one_per_session'),
+            models.UniqueConstraint(fields=['user'], condition=Q(user__isnull=False), name='ship_one_per_user'),
+        ]
+
     def __str__(self):
         return f"Ship for {self.user or self.session_id}"
 
-class Shipping(models.Model):
+class Shipping(DirtyFieldsMixin, models.Model):
     ship = models.ForeignKey(Ship, on_delete=models.CASCADE, related_name='shippings', null=True, blank=True)
     name = models.CharField(max_length=255, null=True, blank=True)
     phone = models.CharField(max_length=255, null=True, blank=True)
@@ -111,26 +346,72 @@ class Shipping(models.Model):
 
     class Meta:
         ordering = ['-default', '-selected', '-created_at']
+        indexes = [
+            models.Index(fields=['ship', 'selected'], name='shipping_ship_selected_idx'),
+        ]
 
-    def save(self, *args, **kwargs):
-        if self.default:
-            Shipping.objects.filter(ship=self.ship, default=True).exclude(pk=self.pk).update(default=False)
-
-        if self.selected:
-            Shipping.objects.filter(ship=self.ship, selected=True).exclude(pk=self.pk).update(selected=False)
-
-        super().save(*args, **kwargs)
-        
-            # ✅ If there's no default shipping, make this one default
-        if not Shipping.objects.filter(ship=self.ship, default=True).exists():
-            self.default = True
-            super().save(update_fields=["default"])
-
-        # ✅ If there's no selected shipping, make this one selected
-        if not Shipping.objects.filter(ship=self.ship, selected=True).exists():
-            self.selected = True
-            super().save(update_fields=["selected"])
+    FLAGS = ('default', 'selected')
 
+    def save(self, *args, **kwargs):
+        # Siblings only need revisiting when a flag or the owning ship
+        # actually changed.
+        flags = [name for name in self.FLAGS if self.has_changed(name, 'ship')]
+        if not flags or self.ship_id is None:
+            return super().save(*args, **kwargs)
+
+        update_fields = self.narrowed_update_fields(args, kwargs)
+        if update_fields is not None:
+            # settle_flags writes the flags of a stored row itself
+            kwargs['update_fields'] = [name for name in update_fields if name not in flags]
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+            self.settle_flags(flags)
+        self._snapshot()
+
+    def settle_flags(self, flags):
+        """
+        Keep one default and one selected address per ship, in one UPDATE
+        over the ship's addresses: a flag set on this address is cleared on
+        the others, and a flag cleared here stays set when no other address
+        has it. Loads this address's resulting flags.
+        """
+        if connection.vendor in ('sqlite', 'postgresql') and connection.features.can_return_columns_from_insert:
+            qn = connection.ops.quote_name
+            table, pk = qn(self._meta.db_table), qn('id')
+            assignments, params = [], []
+            for name in flags:
+                column = qn(name)
+                if getattr(self, name):
+                    assignments.append(f"{column} = ({pk} = %s)")
+                    params.append(self.pk)
+                else:
+                    assignments.append(
+                        f"{column} = CASE WHEN {pk} = %s THEN NOT EXISTS ("
+                        f"SELECT 1 FROM {table} other WHERE other.{qn('ship_id')} = %s "
+                        f"AND other.{pk} <> %s AND other.{column}) ELSE {column} END"
+                    )
+                    params += [self.pk, self.ship_id, self.pk]
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"UPDATE {table} SET {', '.join(assignments)} WHERE {qn('ship_id')} = %s "
+                    f"RETURNING {pk}, {', '.join(qn(name) for name in flags)}",
+                    params + [self.ship_id],
+                )
+                row = next(row for row in cursor.fetchall() if row[0] == self.pk)
+            for name, value in zip(flags, row[1:]):
+                setattr(self, name, bool(value))
+            return
+
+        # Other backends: the same UPDATE through the ORM, and a read back.
+        values = {}
+        for name in flags:
+            if getattr(self, name):
+                values[name] = models.Case(models.When(pk=self.pk, then=True), default=False)
+            else:
+                others = Shipping.objects.filter(ship_id=self.ship_id, **{name: True}).exclude(pk=self.pk)
+                values[name] = models.Case(models.When(pk=self.pk, then=~models.Exists(others)), default=F(name))
+        Shipping.objects.filter(ship_id=self.ship_id).update(**values)
+        self.refresh_from_db(fields=flags)
 
     def __str__(self):
         if self.ship and self.ship.user:
@@ -139,7 +420,7 @@ class Shipping(models.Model):
             return f"Shipping information for session_id: {self.id} {self.ship.session_id}"
         return "Shipping information (no owner)"
 
-class TransactionFlutter(models.Model):
+class TransactionFlutter(DirtyFieldsMixin, models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='transactionflutter')
     tx_ref = models.CharField(max_length=255, unique=True)
     transaction_id = models.CharField(max_length=255, null=True, blank=True)
@@ -150,6 +431,11 @@ class TransactionFlutter(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['cart', 'status'], name='txflutter_cart_status_idx'),
+        ]
+
     def save(self, *args, **kwargs):
         if not self.pk and self.status == "pending":
             other_pending = TransactionFlutter.objects.filter(
@@ -170,7 +456,7 @@ class TransactionFlutter(models.Model):
         else:
             return f"{self.status} - session_id: {self.cart.session_id}"
 
-class TransactionPaystack(models.Model):
+class TransactionPaystack(DirtyFieldsMixin, models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='transactionpaystack')
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
     reference = models.CharField(max_length=255, null=True, blank=True)
@@ -216,4 +502,40 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"Order by {self.full_name} - {self.payment_status}"
\ No newline at end of file
+        return f"Order by {self.full_name} - {self.payment_status}"
+
+class CacheVersion(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} v{self.version}"
+
+class ProductPair(models.Model):
+    # Stored in both directions so the companions of a product are one
+    # index range read.
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='pairs')
+    companion = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='bought_with')
+    count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('product', 'companion')
+        indexes = [
+            models.Index(fields=['product', '-count'], name='productpair_product_count_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} + {self.companion_id}: {self.count}"
+
+class ScanCheckpoint(models.Model):
+    # High-water mark of an incremental batch job, as the (created_at, id) of
+    # the last row it processed.
+    name = models.CharField(max_length=50, unique=True)
+    last_created_at = models.DateTimeField(null=True, blank=True)
+    last_id = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} at {self.last_created_at} #{self.last_id}"
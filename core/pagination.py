@@ -0,0 +1,147 @@
+import base64
+import binascii
+import json
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination that seeks on the ordering columns instead of using OFFSET.
+
+    `ordering` lists the keyset columns, all sorted descending, the last one
+    being unique. Every page is a single range query on those columns, so it
+    costs the same however deep the client pages.
+    """
+    ordering = ('created_at', 'id')
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return settings.PRODUCT_PAGE_SIZE
+        return min(max(page_size, 1), settings.PRODUCT_MAX_PAGE_SIZE)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.model = queryset.model
+        self.annotations = queryset.query.annotations
+        cursor = self.decode_cursor(request)
+
+        # Keyset comparisons never match NULL, so rows without a value in an
+        # ordering column cannot be reached by a cursor and are left out.
+        queryset = queryset.filter(**{f'{name}__isnull': False for name in self.ordering if self.is_nullable(name)})
+
+        if cursor is None:
+            reverse, position = False, None
+        else:
+            reverse, position = cursor
+
+        if reverse:
+            queryset = queryset.order_by(*self.ordering)
+        else:
+            queryset = queryset.order_by(*[f'-{name}' for name in self.ordering])
+        if position is not None:
+            queryset = queryset.filter(self.seek(position, reverse))
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+
+        if reverse:
+            rows.reverse()
+            self.has_previous, self.has_next = has_more, True
+        else:
+            self.has_previous, self.has_next = position is not None, has_more
+
+        self.page = rows
+        return rows
+
+    def seek(self, position, reverse):
+        # (a, b) < (x, y) spelled out as a < x OR (a = x AND b < y), which
+        # every backend can answer from a composite index.
+        lookup = 'gt' if reverse else 'lt'
+        clauses = []
+        for index, name in enumerate(self.ordering):
+            equal = {field: value for field, value in zip(self.ordering[:index], position)}
+            clauses.append(Q(**equal, **{f'{name}__{lookup}': position[index]}))
+        return reduce(or_, clauses)
+
+    def get_position(self, row):
+        if isinstance(row, dict):
+            return [row[name] for name in self.ordering]
+        return [getattr(row, name) for name in self.ordering]
+
+    def encode_cursor(self, row, reverse):
+        values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in self.get_position(row)]
+        token = json.dumps(['p' if reverse else 'n', values], separators=(',', ':'))
+        cursor = base64.urlsafe_b64encode(token.encode()).decode().rstrip('=')
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            token = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+            direction, values = json.loads(token)
+            if direction not in ('n', 'p') or len(values) != len(self.ordering):
+                raise ValueError
+            position = [self.to_python(name, value) for name, value in zip(self.ordering, values)]
+            # NULL rows are never paged through, so no cursor can point at one.
+            if any(value is None for value in position):
+                raise ValueError
+        except (TypeError, ValueError, ValidationError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+
+        return direction == 'p', position
+
+    def is_nullable(self, name):
+        try:
+            return self.model._meta.get_field(name).null
+        except FieldDoesNotExist:
+            return False
+
+    def to_python(self, name, value):
+        try:
+            field = self.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            # Annotated columns such as search_rank convert by their output field
+            if name not in self.annotations:
+                raise ValueError
+            field = self.annotations[name].output_field
+        return field.to_python(value)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+
+class ProductCursorPagination(KeysetPagination):
+    ordering = ('created_at', 'id')
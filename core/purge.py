@@ -0,0 +1,118 @@
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+from .models import Cart, CartItem, Order, Ship, Shipping, TransactionFlutter, TransactionPaystack
+
+
+def stale_guest_carts(cutoff):
+    """
+    Unpaid guest carts with no change to the cart, its items or its payments
+    since `cutoff`. Carts an order points at are kept whatever their state.
+    """
+    return Cart.objects.filter(user=None, paid=False, updated_at__lt=cutoff).exclude(
+        Exists(CartItem.objects.filter(cart=OuterRef('pk'), created_at__gte=cutoff)),
+    ).exclude(
+        Exists(TransactionFlutter.objects.filter(cart=OuterRef('pk'), updated_at__gte=cutoff)),
+    ).exclude(
+        Exists(TransactionPaystack.objects.filter(cart=OuterRef('pk'), updated_at__gte=cutoff)),
+    ).exclude(
+        Exists(Order.objects.filter(cart=OuterRef('pk'))),
+    )
+
+
+def orphaned_guest_ships(cutoff):
+    """
+    Guest ships older than `cutoff` whose session has no cart left and no
+    address added since. Sessions that paid keep their cart, so their
+    addresses are kept too.
+    """
+    return Ship.objects.filter(user=None, created_at__lt=cutoff).exclude(
+        Exists(Cart.objects.filter(user=None, session_id=OuterRef('session_id'))),
+    ).exclude(
+        Exists(Shipping.objects.filter(ship=OuterRef('pk'), created_at__gte=cutoff)),
+    )
+
+
+def stale_pending_transactions(cutoff):
+    """Payments started before `cutoff` and never completed; their checkout links are long dead."""
+    return [
+        model.objects.filter(status='pending', updated_at__lt=cutoff)
+        for model in (TransactionFlutter, TransactionPaystack)
+    ]
+
+
+def pk_batches(queryset, batch_size):
+    """
+    Yield lists of primary keys from `queryset` in ascending order, each
+    batch picking up after the last key of the one before, so rows already
+    handled are never scanned again.
+    """
+    last = None
+    while True:
+        page = queryset.order_by('pk')
+        if last is not None:
+            page = page.filter(pk__gt=last)
+        batch = list(page.values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            return
+        yield batch
+        last = batch[-1]
+
+
+def delete_in_batches(queryset, batch_size, progress=None):
+    """
+    Delete `queryset` a primary-key batch at a time, each batch in its own
+    short transaction. Returns the number of rows deleted per model.
+    """
+    deleted = {}
+    for batch in pk_batches(queryset, batch_size):
+        with transaction.atomic():
+            # Re-checked here: a row touched since its key was read is kept.
+            _, per_model = queryset.filter(pk__in=batch).delete()
+        for label, count in per_model.items():
+            deleted[label] = deleted.get(label, 0) + count
+        if progress:
+            progress(deleted)
+    return deleted
+
+
+def update_in_batches(queryset, batch_size, progress=None, **values):
+    """
+    Update `queryset` a primary-key batch at a time. Returns the rows updated.
+    """
+    label, updated = f'{queryset.model._meta.label} canceled', 0
+    for batch in pk_batches(queryset, batch_size):
+        updated += queryset.filter(pk__in=batch).update(**values)
+        if progress:
+            progress({label: updated})
+    return {label: updated}
+
+
+def purge_stale_sessions(cutoff, batch_size=1000, dry_run=False, progress=None):
+    """
+    Cancel payments left pending since before `cutoff`, then delete
+    abandoned guest carts (with their items and payments) and the guest
+    ships left without a cart. Returns row counts per model; with
+    `dry_run` nothing is written and the counts are of the top-level rows
+    that would be touched.
+    """
+    carts = stale_guest_carts(cutoff)
+    if dry_run:
+        counts = {
+            f'{queryset.model._meta.label} canceled': queryset.count()
+            for queryset in stale_pending_transactions(cutoff)
+        }
+        counts['core.Cart'] = carts.count()
+        counts['core.CartItem'] = CartItem.objects.filter(cart__in=carts).count()
+        # Ships whose session only loses its cart in this run are not counted.
+        counts['core.Ship'] = orphaned_guest_ships(cutoff).count()
+        return counts
+
+    counts = {}
+    for queryset in stale_pending_transactions(cutoff):
+        counts.update(update_in_batches(queryset, batch_size, progress, status='canceled'))
+    # Carts first: a ship only counts as orphaned once its session's cart is gone.
+    for queryset in (carts, orphaned_guest_ships(cutoff)):
+        for label, count in delete_in_batches(queryset, batch_size, progress).items():
+            counts[label] = counts.get(label, 0) + count
+    return counts
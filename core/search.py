@@ -0,0 +1,134 @@
+import re
+
+from django.db import connection
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+from .pagination import KeysetPagination
+
+# The search document is title + description + category, kept in sync by the
+# database itself (FTS5 triggers on SQLite, a generated tsvector column on
+# Postgres) so bulk writes that skip Product.save are indexed as well.
+
+SQLITE_INSTALL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS core_product_fts USING fts5(
+        title, description, category,
+        content='core_product', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS core_product_fts_ai AFTER INSERT ON core_product BEGIN
+        INSERT INTO core_product_fts(rowid, title, description, category)
+        VALUES (new.id, new.title, new.description, new.category);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS core_product_fts_ad AFTER DELETE ON core_product BEGIN
+        INSERT INTO core_product_fts(core_product_fts, rowid, title, description, category)
+        VALUES ('delete', old.id, old.title, old.description, old.category);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS core_product_fts_au AFTER UPDATE OF title, description, category ON core_product BEGIN
+        INSERT INTO core_product_fts(core_product_fts, rowid, title, description, category)
+        VALUES ('delete', old.id, old.title, old.description, old.category);
+        INSERT INTO core_product_fts(rowid, title, description, category)
+        VALUES (new.id, new.title, new.description, new.category);
+    END
+    """,
+    "INSERT INTO core_product_fts(core_product_fts) VALUES ('rebuild')",
+]
+
+SQLITE_UNINSTALL = [
+    "DROP TRIGGER IF EXISTS core_product_fts_au",
+    "DROP TRIGGER IF EXISTS core_product_fts_ad",
+    "DROP TRIGGER IF EXISTS core_product_fts_ai",
+    "DROP TABLE IF EXISTS core_product_fts",
+]
+
+POSTGRES_INSTALL = [
+    """
+    ALTER TABLE core_product ADD COLUMN IF NOT EXISTS search_document tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(category, '')), 'B') ||
+        setweight(to_tsvector('simple', coalesce(description, '')), 'C')
+    ) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS core_product_search_idx ON core_product USING GIN (search_document)",
+]
+
+POSTGRES_UNINSTALL = [
+    "DROP INDEX IF EXISTS core_product_search_idx",
+    "ALTER TABLE core_product DROP COLUMN IF EXISTS search_document",
+]
+
+# Column weights for bm25(), in FTS table column order: title, description, category.
+SQLITE_WEIGHTS = '10.0, 1.0, 5.0'
+
+MAX_TERMS = 8
+
+
+def install_index(schema_editor):
+    """Create the search index for the current backend. Safe to run again,
+    e.g. after a migration that rebuilds the core_product table on SQLite."""
+    vendor = schema_editor.connection.vendor
+    statements = {'sqlite': SQLITE_INSTALL, 'postgresql': POSTGRES_INSTALL}.get(vendor, [])
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def uninstall_index(schema_editor):
+    vendor = schema_editor.connection.vendor
+    statements = {'sqlite': SQLITE_UNINSTALL, 'postgresql': POSTGRES_UNINSTALL}.get(vendor, [])
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def tokenize(term):
+    return re.findall(r'\w+', (term or '').lower())[:MAX_TERMS]
+
+
+def search_products(queryset, term):
+    """
+    Filter `queryset` to products matching every word of `term` (as a prefix)
+    and annotate it with `search_rank`, higher meaning more relevant.
+    """
+    tokens = tokenize(term)
+    if not tokens:
+        return queryset.annotate(search_rank=Value(0.0, output_field=FloatField())).none()
+
+    if connection.vendor == 'sqlite':
+        # Join the FTS table once so MATCH and bm25() are evaluated a single
+        # time per query rather than once per candidate row.
+        match = ' '.join(f'"{token}"*' for token in tokens)
+        return queryset.extra(
+            tables=['core_product_fts'],
+            where=['core_product_fts.rowid = core_product.id', 'core_product_fts MATCH %s'],
+            params=[match],
+        ).annotate(
+            search_rank=RawSQL(f'-bm25(core_product_fts, {SQLITE_WEIGHTS})', [], output_field=FloatField()),
+        )
+
+    if connection.vendor == 'postgresql':
+        query = ' & '.join(f'{token}:*' for token in tokens)
+        return queryset.filter(
+            RawSQL("core_product.search_document @@ to_tsquery('simple', %s)", [query], output_field=BooleanField()),
+        ).annotate(
+            search_rank=RawSQL(
+                "ts_rank_cd(core_product.search_document, to_tsquery('simple', %s))",
+                [query],
+                output_field=FloatField(),
+            ),
+        )
+
+    match = Q()
+    for token in tokens:
+        match &= Q(title__icontains=token) | Q(description__icontains=token) | Q(category__icontains=token)
+    return queryset.filter(match).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+class ProductSearchPagination(KeysetPagination):
+    ordering = ('search_rank', 'id')
@@ -1,5 +1,10 @@
+import decimal
+
+from django.utils.encoding import is_protected_type
 from rest_framework import serializers
+from rest_framework.settings import api_settings
 from .models import Product, Cart, CartItem, Shipping, Country, Ship
+from .countries import is_known_country
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
@@ -30,7 +35,88 @@ class UserSignUpSerializer(serializers.ModelSerializer):
 class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
-        fields = ['id', 'title', 'slug', 'image', 'price', 'category', 'description']
+        fields = ['id', 'title', 'slug', 'image', 'image_urls', 'price', 'category', 'description']
+
+
+def value_converter(field):
+    """Compile the per-value work of `field.to_representation`, or None when it is a no-op."""
+    if isinstance(field, serializers.DecimalField):
+        if not getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING) or field.localize or field.normalize_output:
+            return field.to_representation
+        if field.decimal_places is None:
+            return lambda value: format(value, 'f')
+        # DecimalField.quantize builds the same context and exponent per call
+        context = decimal.getcontext().copy()
+        if field.max_digits is not None:
+            context.prec = field.max_digits
+        exponent = decimal.Decimal('.1') ** field.decimal_places
+        rounding = field.rounding
+        return lambda value: format(value.quantize(exponent, rounding=rounding, context=context), 'f')
+    if isinstance(field, serializers.ModelField):
+        # ModelField renders through the model field's value_to_string.
+        get_prep_value = field.model_field.get_prep_value
+        return lambda value: value if is_protected_type(value) else get_prep_value(value)
+    if isinstance(field, (serializers.IntegerField, serializers.CharField, serializers.ChoiceField,
+                          serializers.BooleanField, serializers.JSONField)) and not getattr(field, 'binary', False):
+        return None
+    return field.to_representation
+
+
+class ValuesSerializer:
+    """
+    Read-only twin of a ModelSerializer that renders `.values()` rows.
+
+    Only the serializer's columns are selected and each value goes through a
+    converter compiled once from the serializer's fields, so large lists skip
+    model instantiation and DRF's per-field machinery while producing the
+    same output.
+    """
+
+    def __init__(self, serializer, prefix=''):
+        self.plan = []
+        self.columns = []
+        self.pk = f'{prefix}{serializer.Meta.model._meta.pk.name}'
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, serializers.ListSerializer):
+                raise TypeError(f'{name}: to-many relations cannot be read from values() rows')
+            if isinstance(field, serializers.BaseSerializer):
+                nested = ValuesSerializer(field, f'{prefix}{field.source}__')
+                self.columns.extend(nested.columns)
+                self.plan.append((name, None, nested))
+            else:
+                column = f'{prefix}{field.source}'
+                self.columns.append(column)
+                self.plan.append((name, column, value_converter(field)))
+        if self.pk not in self.columns:
+            self.columns.append(self.pk)
+
+    def values(self, queryset, *extra):
+        return queryset.values(*dict.fromkeys([*self.columns, *extra]))
+
+    def to_representation(self, row):
+        if row[self.pk] is None:
+            return None
+        data = {}
+        for name, column, convert in self.plan:
+            if column is None:
+                data[name] = convert.to_representation(row)
+                continue
+            value = row[column]
+            data[name] = value if value is None or convert is None else convert(value)
+        return data
+
+    def render(self, rows):
+        return [self.to_representation(row) for row in rows]
+
+
+class ProductFacetSerializer(serializers.Serializer):
+    category = serializers.CharField()
+    label = serializers.CharField()
+    count = serializers.IntegerField()
+    min_price = serializers.DecimalField(max_digits=10, decimal_places=2, allow_null=True)
+    max_price = serializers.DecimalField(max_digits=10, decimal_places=2, allow_null=True)
 
 
 class CartItemSerializer(serializers.ModelSerializer):
@@ -40,14 +126,32 @@ class CartItemSerializer(serializers.ModelSerializer):
         fields = ['id', 'product', 'quantity']
 
 
+product_values = ValuesSerializer(ProductSerializer())
+
+
 class CartSerializer(serializers.ModelSerializer):
     total_items = serializers.IntegerField(source="get_total_items", read_only=True)
     total_price = serializers.DecimalField(source="get_total_price", decimal_places=2, max_digits=10, read_only=True)
     link = serializers.CharField(source="get_flutter_link", read_only=True)
+    revision = serializers.CharField(source="revision_tag", read_only=True)
     cartitem = CartItemSerializer(read_only=True, many=True) 
     class Meta:
         model = Cart
-        fields = ['id', 'cartitem', 'total_items', 'total_price', 'paid', 'link', 'updated_at']
+        fields = ['id', 'cartitem', 'total_items', 'total_price', 'paid', 'link', 'updated_at', 'revision']
+
+
+class BufferedCartSerializer(CartSerializer):
+    # Unsaved carts (from the guest cart store, or empty ones not created
+    # yet) keep their items in a list.
+    cartitem = CartItemSerializer(source='buffered_items', read_only=True, many=True)
+
+
+class CartDeltaSerializer(BufferedCartSerializer):
+    # Loaded by carts.cart_changes: `cartitem` holds only the items changed
+    # since the client's revision, `removed` the slugs taken out since.
+    removed = serializers.ListField(child=serializers.CharField(), read_only=True)
+    class Meta(CartSerializer.Meta):
+        fields = CartSerializer.Meta.fields + ['removed']
 
 
 class ShippingSerializer(serializers.ModelSerializer):
@@ -60,6 +164,12 @@ class ShippingSerializer(serializers.ModelSerializer):
         model = Shipping
         fields = ['id', 'name', 'phone', 'email', 'city', 'state', 'address', 'zip_code', 'country', 'selected', 'default']
 
+    def validate_country(self, value):
+        # Checked against the in-process country table, not the database
+        if value and not is_known_country(value):
+            raise serializers.ValidationError('Unknown country.')
+        return value
+
 class ShipSerializer(serializers.ModelSerializer):
     shippings = ShippingSerializer(many=True, read_only=True)
     class Meta:
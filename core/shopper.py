@@ -0,0 +1,229 @@
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, OuterRef, Subquery, Sum, prefetch_related_objects
+
+from .cartstore import GuestCart, cart_store_enabled, discard_guest_cart, flush_guest_cart
+from .models import Cart, CartItem, Ship, Shipping, TransactionFlutter, cart_prefetches
+
+
+class Shopper:
+    """
+    The user or guest session behind a request.
+
+    The open cart, the ship and its selected shipping are each loaded on
+    first use and shared by everything else that handles the request.
+    Reading them never creates rows; `cart` and `ship` create them for the
+    handlers that write.
+    """
+
+    def __init__(self, user, session_id):
+        self.user = user
+        self.session_id = session_id
+        self._cart = None
+        self._guest_cart = None
+        self._ship = None
+        self._shipping = None
+
+    @property
+    def identified(self):
+        return self.user is not None or bool(self.session_id)
+
+    @property
+    def owner(self):
+        """Lookup arguments that select this shopper's carts and ship."""
+        if self.user is not None:
+            return {'user': self.user, 'session_id': None}
+        return {'user': None, 'session_id': self.session_id}
+
+    @property
+    def guest_cart(self):
+        """The buffered GuestCart when the cache cart store is on and this is a guest, else None."""
+        if self._guest_cart is None and self.user is None and self.session_id and cart_store_enabled():
+            self._guest_cart = GuestCart(self.session_id)
+        return self._guest_cart
+
+    def _find_cart(self, queryset):
+        return queryset.filter(**self.owner, paid=False).first()
+
+    @property
+    def cart(self):
+        """The open cart, created on first use. Only handlers that write to it use this."""
+        if self._cart is None or self._cart.pk is None:
+            # get_or_create re-selects when a concurrent create trips the
+            # one-open-cart constraint.
+            self._cart, created = Cart.objects.get_or_create(**self.owner, paid=False)
+            if created:
+                # Nothing to count or prefetch for a cart that was just created.
+                self._cart._prefetched_objects_cache = {'cartitem': self._cart.cartitem.none()}
+                self._cart.total_items, self._cart.total_price = 0, Decimal('0.00')
+                self._cart.pending_transactions = []
+        return self._cart
+
+    @property
+    def stored_cart(self):
+        """The open cart if this shopper has one, else None. Never writes."""
+        if self._cart is None:
+            self._cart = self._find_cart(Cart.objects) or empty_cart(self.owner)
+        return self._cart if self._cart.pk else None
+
+    @property
+    def cart_with_items(self):
+        """
+        The open cart with totals, items, products and the pending payment
+        loaded, or an empty unsaved cart (see empty_cart) when there is none.
+        """
+        if self._cart is None:
+            self._cart = self._find_cart(Cart.objects.with_totals()) or empty_cart(self.owner)
+        elif self._cart.pk and 'cartitem' not in getattr(self._cart, '_prefetched_objects_cache', {}):
+            prefetch_related_objects([self._cart], *cart_prefetches())
+        return self._cart
+
+    def cart_changed(self):
+        """Forget the loaded items and totals after the cart was modified."""
+        if self._cart is not None:
+            if self._cart.pk is None:
+                self._cart = None
+                return
+            for name in ('total_items', 'total_price', 'pending_transactions'):
+                self._cart.__dict__.pop(name, None)
+            getattr(self._cart, '_prefetched_objects_cache', {}).clear()
+            self._cart.refresh_from_db(fields=['revision', 'updated_at'])
+
+    @property
+    def ship(self):
+        """The ship, created on first use. Only handlers that add addresses use this."""
+        if not self._ship:
+            # Like carts, ships are unique per owner; get_or_create re-selects
+            # when a concurrent create wins.
+            self._ship, created = Ship.objects.get_or_create(**self.owner)
+            if created:
+                self._shipping = False
+        return self._ship
+
+    @property
+    def stored_ship(self):
+        """The ship if this shopper has one, else None. Never writes."""
+        if self._ship is None:
+            self._ship = Ship.objects.filter(**self.owner).first() or False
+            if not self._ship:
+                self._shipping = False
+        return self._ship or None
+
+    @property
+    def shipping(self):
+        """The selected shipping address, or None."""
+        ship = self.stored_ship
+        if self._shipping is None:
+            self._shipping = Shipping.objects.filter(ship=ship, selected=True).first() or False
+        return self._shipping or None
+
+    def find_shipping(self, shipping_id):
+        """One of this shopper's addresses by id, or None, in one query and without loading the ship."""
+        owner = {f'ship__{name}': value for name, value in self.owner.items()}
+        return Shipping.objects.filter(pk=shipping_id, **owner).first()
+
+
+def empty_cart(owner):
+    """
+    Unsaved, empty open cart, shown to shoppers who have not added anything
+    yet so that reading a cart never creates one. Serialize it with
+    BufferedCartSerializer.
+    """
+    cart = Cart(**owner, paid=False)
+    cart.buffered_items = []
+    cart.total_items, cart.total_price = 0, Decimal('0.00')
+    cart.pending_transactions = []
+    return cart
+
+
+def get_shopper(request):
+    """Resolve the shopper once per request and expose it as `request.shopper`."""
+    if not hasattr(request, 'shopper'):
+        user = request.user if request.user.is_authenticated else None
+        params = request.query_params if request.method == 'GET' else request.data
+        request.shopper = Shopper(user, params.get('session_id'))
+    return request.shopper
+
+
+def merge_guest_session(user, session_id):
+    """
+    Fold a guest session's open cart and addresses into `user`'s.
+
+    Quantities of products in both carts are summed, the other guest items
+    and every guest address move over, and the guest rows are deleted. Each
+    step is one set-based query however many items or addresses there are;
+    when the user has no cart or ship yet the guest row is simply handed over.
+    """
+    if not session_id:
+        return
+
+    flush_guest_cart(session_id)
+    with transaction.atomic():
+        guest_carts = list(Cart.objects.filter(user=None, session_id=session_id, paid=False).values_list('pk', flat=True))
+        if guest_carts:
+            user_cart = Cart.objects.filter(user=user, session_id=None, paid=False).first()
+            if user_cart is None:
+                try:
+                    with transaction.atomic():
+                        Cart.objects.filter(pk=guest_carts[0]).update(user=user, session_id=None)
+                    guest_carts = guest_carts[1:]
+                except IntegrityError:
+                    # A concurrent request gave the user an open cart first; merge into it.
+                    pass
+                user_cart = Cart.objects.filter(user=user, session_id=None, paid=False).first()
+            if guest_carts:
+                merge_cart_items(guest_carts, user_cart)
+        discard_guest_cart(session_id)
+
+        guest_ships = list(Ship.objects.filter(user=None, session_id=session_id).values_list('pk', flat=True))
+        if guest_ships:
+            user_ship = Ship.objects.filter(user=user, session_id=None).first()
+            if user_ship is None:
+                try:
+                    with transaction.atomic():
+                        Ship.objects.filter(pk=guest_ships[0]).update(user=user, session_id=None)
+                    guest_ships = guest_ships[1:]
+                except IntegrityError:
+                    # As for carts: another request gave the user a ship first.
+                    pass
+                user_ship = Ship.objects.filter(user=user, session_id=None).first()
+            if guest_ships:
+                merge_shippings(guest_ships, user_ship)
+
+
+def merge_cart_items(guest_carts, user_cart):
+    # Several guest carts may hold the same product, so their quantities are
+    # summed per product before anything lands in the user's cart.
+    guest_items = CartItem.objects.filter(cart__in=guest_carts)
+    guest_quantity = guest_items.filter(product=OuterRef('product')).order_by().values('product').annotate(
+        total=Sum('quantity'),
+    ).values('total')
+    totals = dict(guest_items.order_by().values('product').annotate(total=Sum('quantity')).values_list('product', 'total'))
+    shared = set(CartItem.objects.filter(cart=user_cart, product__in=totals).values_list('product', flat=True))
+    revision = Cart.objects.next_revision(user_cart.pk)
+
+    CartItem.objects.filter(cart=user_cart, product__in=shared).update(
+        quantity=F('quantity') + Subquery(guest_quantity), revision=revision,
+    )
+    CartItem.objects.bulk_create([
+        CartItem(cart=user_cart, product_id=product_id, quantity=total, revision=revision)
+        for product_id, total in totals.items() if product_id not in shared
+    ])
+    # The amount of a pending payment no longer matches the merged cart.
+    TransactionFlutter.objects.filter(cart=user_cart, status='pending').update(status='canceled')
+    # Deleting the guest carts takes their items with them.
+    Cart.objects.filter(pk__in=guest_carts).delete()
+
+
+def merge_shippings(guest_ships, user_ship):
+    # The user's default address stays the default; a guest selection is
+    # the most recent choice, so it wins over the user's.
+    guest_shippings = Shipping.objects.filter(ship__in=guest_ships)
+    if guest_shippings.filter(selected=True).exists():
+        Shipping.objects.filter(ship=user_ship, selected=True).update(selected=False)
+    if Shipping.objects.filter(ship=user_ship, default=True).exists():
+        guest_shippings.update(ship=user_ship, default=False)
+    else:
+        guest_shippings.update(ship=user_ship)
+    Ship.objects.filter(pk__in=guest_ships).delete()
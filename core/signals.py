@@ -0,0 +1,28 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import CATALOG, bump_version_on_commit
+from .countries import COUNTRY, country_table
+from .models import Country, Product
+from .suggest import title_index
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, **kwargs):
+    bump_version_on_commit(CATALOG)
+    transaction.on_commit(lambda: title_index.update(instance))
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    pk = instance.pk
+    bump_version_on_commit(CATALOG)
+    transaction.on_commit(lambda: title_index.remove(pk))
+
+
+@receiver(post_save, sender=Country)
+@receiver(post_delete, sender=Country)
+def country_changed(sender, instance, **kwargs):
+    bump_version_on_commit(COUNTRY)
+    transaction.on_commit(country_table.invalidate)
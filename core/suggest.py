@@ -0,0 +1,247 @@
+import bisect
+import heapq
+import itertools
+import re
+import threading
+import time
+import unicodedata
+
+from django.conf import settings
+
+from .cache import CATALOG, get_version
+from .models import Product
+
+# Prefixes up to this length match a large slice of the catalog, so their
+# best matches are precomputed instead of ranked on every keystroke.
+SHORT_PREFIX = 3
+# Upper bound on entries ranked for a longer prefix.
+MAX_SCAN = 2000
+MAX_CACHED_RESULTS = 10000
+# Words shorter than this are too ambiguous to correct.
+MIN_FUZZY_WORD = 3
+# Upper bound on corrected queries looked up for one typed query.
+MAX_FUZZY_QUERIES = 64
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(re.findall(r'\w+', text.lower()))
+
+
+def one_edit_variants(word, prefixes):
+    """
+    Prefixes of indexed words one deletion, transposition, substitution or
+    insertion away from word. `prefixes` maps every prefix of an indexed
+    word to the characters that may follow it, so only edits that stay on
+    an indexed word are tried; an edit after a prefix no word starts with
+    cannot lead anywhere either.
+    """
+    variants = set()
+    for i in range(len(word) + 1):
+        left, right = word[:i], word[i:]
+        following = prefixes.get(left)
+        if following is None:
+            break
+        candidates = [left + char + right for char in following]
+        if right:
+            candidates.append(left + right[1:])
+            candidates.extend(left + char + right[1:] for char in following)
+        if len(right) > 1:
+            candidates.append(left + right[1] + right[0] + right[2:])
+        variants.update(candidate for candidate in candidates if candidate in prefixes)
+    variants.discard(word)
+    return variants
+
+
+class TitleIndex:
+    """
+    Process-local sorted index of normalized product titles and slugs.
+
+    Every word start of a title is a key, so "watch" finds "Smart Watch".
+    Lookups are binary searches over an in-memory list and never touch the
+    database. The catalog version is re-checked at most every
+    SUGGEST_REFRESH_SECONDS; changes made by this process are applied
+    incrementally, changes made elsewhere trigger a rebuild.
+    """
+
+    def __init__(self):
+        self._keys = []
+        self._products = {}
+        self._top = {}
+        self._results = {}
+        self._words = set()
+        self._word_prefixes = {}
+        self._lock = threading.Lock()
+        self.version = None
+        self.pending_bumps = 0
+        self.checked_at = 0.0
+
+    def keys_for(self, title, slug):
+        words = normalize(title).split()
+        keys = {' '.join(words[i:]) for i in range(len(words))}
+        keys.add(normalize((slug or '').replace('-', ' ')))
+        keys.discard('')
+        return keys
+
+    def add_words(self, keys, words, word_prefixes):
+        for word in {word for key in keys for word in key.split()} - words:
+            words.add(word)
+            word_prefixes.setdefault(word, '')
+            for i in range(len(word)):
+                following = word_prefixes.setdefault(word[:i], '')
+                if word[i] not in following:
+                    word_prefixes[word[:i]] = following + word[i]
+
+    def rebuild(self, version):
+        keys, products, words, word_prefixes = [], {}, set(), {}
+        for pk, slug, title, created_at in Product.objects.values_list('id', 'slug', 'title', 'created_at').iterator():
+            score = created_at.timestamp() if created_at else 0.0
+            entry_keys = self.keys_for(title, slug)
+            products[pk] = (slug, title, score, entry_keys)
+            keys.extend((key, pk) for key in entry_keys)
+            self.add_words(entry_keys, words, word_prefixes)
+        keys.sort()
+
+        # Visiting products best first fills each short-prefix list already
+        # in rank order.
+        top = {}
+        for pk in sorted(products, key=lambda pk: products[pk][2], reverse=True):
+            for prefix in {key[:length] for key in products[pk][3] for length in range(1, SHORT_PREFIX + 1)}:
+                ranked = top.setdefault(prefix, [])
+                if len(ranked) < settings.SUGGEST_MAX_LIMIT:
+                    ranked.append(pk)
+
+        with self._lock:
+            self._keys, self._products, self._top = keys, products, top
+            self._words, self._word_prefixes = words, word_prefixes
+            self._results = {}
+            self.version, self.pending_bumps = version, 0
+
+    def ensure_fresh(self):
+        now = time.monotonic()
+        if self.version is not None and now - self.checked_at < settings.SUGGEST_REFRESH_SECONDS:
+            return
+        self.checked_at = now
+        version, _ = get_version(CATALOG)
+        with self._lock:
+            # Bumps caused by saves in this process were already applied.
+            if self.version is not None and version == self.version + self.pending_bumps:
+                self.version, self.pending_bumps = version, 0
+                return
+        self.rebuild(version)
+
+    def _changed(self, keys):
+        # Short-prefix lists touching these keys are recomputed on next use.
+        for key in keys:
+            for length in range(1, SHORT_PREFIX + 1):
+                self._top.pop(key[:length], None)
+        self._results = {}
+
+    def _remove(self, pk):
+        entry = self._products.pop(pk, None)
+        if entry is None:
+            return
+        for key in entry[3]:
+            index = bisect.bisect_left(self._keys, (key, pk))
+            if index < len(self._keys) and self._keys[index] == (key, pk):
+                del self._keys[index]
+        self._changed(entry[3])
+
+    def update(self, product):
+        with self._lock:
+            if self.version is None:
+                return
+            self._remove(product.pk)
+            score = product.created_at.timestamp() if product.created_at else 0.0
+            entry_keys = self.keys_for(product.title, product.slug)
+            self._products[product.pk] = (product.slug, product.title, score, entry_keys)
+            for key in entry_keys:
+                bisect.insort(self._keys, (key, product.pk))
+            # Words of removed titles stay; a correction to them finds nothing.
+            self.add_words(entry_keys, self._words, self._word_prefixes)
+            self._changed(entry_keys)
+            self.pending_bumps += 1
+
+    def remove(self, pk):
+        with self._lock:
+            if self.version is None:
+                return
+            self._remove(pk)
+            self.pending_bumps += 1
+
+    def _prefix(self, prefix, limit):
+        """Best product ids with a key starting with prefix."""
+        short = len(prefix) <= SHORT_PREFIX
+        if short and prefix in self._top:
+            return self._top[prefix][:limit]
+
+        start = bisect.bisect_left(self._keys, (prefix,))
+        end = len(self._keys) if short else min(start + MAX_SCAN, len(self._keys))
+        matches = set()
+        for index in range(start, end):
+            key, pk = self._keys[index]
+            if not key.startswith(prefix):
+                break
+            matches.add(pk)
+
+        ranked = heapq.nlargest(
+            settings.SUGGEST_MAX_LIMIT if short else limit, matches, key=lambda pk: self._products[pk][2]
+        )
+        if short:
+            self._top[prefix] = ranked
+        return ranked[:limit]
+
+    def _exists(self, prefix):
+        index = bisect.bisect_left(self._keys, (prefix,))
+        return index < len(self._keys) and self._keys[index][0].startswith(prefix)
+
+    def _corrections(self, query):
+        """
+        Queries with at most one typo fixed per word, bounded by
+        MAX_FUZZY_QUERIES. Earlier words must be whole indexed words, the
+        last one only the start of one.
+        """
+        *earlier, last = query.split()
+        choices = []
+        for word in earlier:
+            if word in self._words or len(word) < MIN_FUZZY_WORD:
+                choices.append([word])
+            else:
+                choices.append(sorted(self._words.intersection(one_edit_variants(word, self._word_prefixes))))
+        if len(last) < MIN_FUZZY_WORD:
+            choices.append([last])
+        else:
+            choices.append([last, *sorted(one_edit_variants(last, self._word_prefixes))])
+        corrected = (' '.join(words) for words in itertools.product(*choices))
+        return [text for text in itertools.islice(corrected, MAX_FUZZY_QUERIES + 1) if text != query]
+
+    def suggest(self, query, limit):
+        self.ensure_fresh()
+        query = normalize(query)
+        if not query:
+            return []
+
+        with self._lock:
+            results = self._results.get((query, limit))
+            if results is not None:
+                return results
+
+            ranked = self._prefix(query, limit)
+            if len(ranked) < limit and len(query) >= MIN_FUZZY_WORD:
+                # Tolerate one typo per word typed so far.
+                fuzzy = set()
+                for corrected in self._corrections(query):
+                    if self._exists(corrected):
+                        fuzzy.update(self._prefix(corrected, limit))
+                fuzzy.difference_update(ranked)
+                ranked = ranked + heapq.nlargest(limit - len(ranked), fuzzy, key=lambda pk: self._products[pk][2])
+
+            results = [{'slug': self._products[pk][0], 'title': self._products[pk][1]} for pk in ranked]
+            if len(self._results) >= MAX_CACHED_RESULTS:
+                self._results = {}
+            self._results[(query, limit)] = results
+            return results
+
+
+title_index = TitleIndex()
@@ -1,3 +1,244 @@
-from django.test import TestCase
+import re
+import tempfile
+import threading
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import close_old_connections, connection
+from django.test import TestCase, TransactionTestCase
+
+from .carts import apply_cart_ops, upsert_cart_item
+from .countries import country_table
+from .models import Cart, CartItem, Product, Ship, Shipping, TransactionFlutter
+from .search import search_products
+from .shopper import Shopper
+from .suggest import title_index
+
+FULL_SCAN = {
+    # "SCAN t" is a full table scan; "SCAN t USING [COVERING] INDEX" walks an
+    # index in order and FTS5 tables report "SCAN t VIRTUAL TABLE INDEX".
+    'sqlite': re.compile(r'\bSCAN (\w+)$', re.MULTILINE),
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+}
+
+
+def hot_queries():
+    """The lookups core/views.py runs on every catalog, cart and checkout request."""
+    page = slice(0, 25)
+    return {
+        'product list': Product.objects.order_by('-created_at', '-id')[page],
+        'product list by category': Product.objects.filter(category='JEWELRY').order_by('-created_at', '-id')[page],
+        'product search': search_products(Product.objects.all(), 'bag').order_by('-search_rank', '-id')[page],
+        'product by slug': Product.objects.filter(slug='bag'),
+        'user cart': Cart.objects.filter(user_id=1, session_id=None, paid=False),
+        'guest cart': Cart.objects.filter(user=None, session_id='session', paid=False),
+        'guest orders': Cart.objects.filter(user=None, session_id='session', paid=True),
+        'cart items': CartItem.objects.filter(cart_id=1),
+        'cart item by product': CartItem.objects.filter(cart_id=1, product_id=1),
+        'user ship': Ship.objects.filter(user_id=1, session_id=None),
+        'guest ship': Ship.objects.filter(user=None, session_id='session'),
+        'ship by session': Ship.objects.filter(session_id='session'),
+        'selected shipping': Shipping.objects.filter(ship_id=1, selected=True),
+        'shipping by id and owner': Shipping.objects.filter(pk=1, ship__user=None, ship__session_id='session'),
+        'pending flutter transaction': TransactionFlutter.objects.filter(cart_id=1, status='pending'),
+        'flutter transaction by tx_ref': TransactionFlutter.objects.filter(tx_ref='ref'),
+    }
+
+
+class QueryPlanTests(TestCase):
+    """The hot queries must be served by an index, never a full table scan."""
+
+    def test_hot_queries_use_an_index(self):
+        pattern = FULL_SCAN.get(connection.vendor)
+        if pattern is None:
+            self.skipTest(f'No plan checks for the {connection.vendor} backend')
+        if connection.vendor == 'postgresql':
+            # Small tables make a sequential scan the cheapest plan, so only
+            # report one when no index could serve the query at all.
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+        for name, queryset in hot_queries().items():
+            with self.subTest(name):
+                plan = queryset.explain()
+                self.assertEqual(pattern.findall(plan), [], plan)
+
+
+class ShippingQueryTests(TestCase):
+    """Query budgets for the shipping address endpoints, for a shopper whose ship already exists."""
+
+    def setUp(self):
+        self.ship = Ship.objects.create(session_id='shopper')
+        self.first = Shipping.objects.create(ship=self.ship, name='first', selected=True, default=True)
+        self.second = Shipping.objects.create(ship=self.ship, name='second')
+        # The budgets are for a warm process; the country table loads once per worker.
+        country_table.get()
+
+    def request(self, method, path, data):
+        response = getattr(self.client, method)(path, {'session_id': 'shopper', **data}, content_type='application/json')
+        self.assertLess(response.status_code, 400, response.content)
+        return response
+
+    def address(self, **data):
+        return {
+            'email': 'shopper@example.com', 'phone': '0', 'city': 'c', 'state': 's', 'address': 'a',
+            'country': 'Nigeria', **data,
+        }
+
+    def test_add_address(self):
+        with self.assertNumQueries(3):
+            self.request('post', '/shipping/', self.address(name='third'))
+
+    def test_add_default_address(self):
+        with self.assertNumQueries(3):
+            self.request('post', '/shipping/', self.address(name='third', default='true'))
+
+    def test_select_address(self):
+        with self.assertNumQueries(2):
+            self.request('patch', '/shippingtrue/', {'shipping_id': self.second.pk})
+
+    def test_make_address_default(self):
+        with self.assertNumQueries(2):
+            self.request('patch', '/shippingtrue/', {'shipping_id': self.second.pk, 'default': True})
+
+    def test_edit_address(self):
+        with self.assertNumQueries(2):
+            self.request('patch', '/shippingupdate/', {'shipping_id': self.second.pk, 'city': 'elsewhere'})
+
+    def test_edit_and_select_address(self):
+        with self.assertNumQueries(3):
+            self.request('patch', '/shippingupdate/', {'shipping_id': self.second.pk, 'city': 'again', 'selected': True})
+
+
+class SuggestTests(TestCase):
+    def setUp(self):
+        for title in ('Wireless Headphones Pro', 'Wired Headset', 'Leather Bag'):
+            Product.objects.create(title=title, price=Decimal('1.00'))
+        title_index.rebuild(title_index.version)
+
+    def titles(self, query):
+        return [result['title'] for result in title_index.suggest(query, 8)]
+
+    def test_one_typo_per_word(self):
+        self.assertEqual(self.titles('wireles headphons'), ['Wireless Headphones Pro'])
+        self.assertEqual(self.titles('lether'), ['Leather Bag'])
+
+    def test_earlier_words_must_be_whole(self):
+        self.assertEqual(self.titles('wire headphones'), [])
+
+
+class ImportProductsTests(TestCase):
+    def test_bad_prices_are_reported_and_skipped(self):
+        rows = ['title,slug,price', 'Good,good,12.50', 'Nan,nan,NaN', 'Big,big,12345678901234', 'Neg,neg,-1', 'Fine,fine,3']
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as handle:
+            handle.write('\n'.join(rows))
+            handle.flush()
+            stderr = StringIO()
+            call_command('import_products', handle.name, stdout=StringIO(), stderr=stderr)
+
+        self.assertEqual(dict(Product.objects.values_list('slug', 'price')), {'good': Decimal('12.50'), 'fine': Decimal('3')})
+        self.assertEqual([line.split(':')[0] for line in stderr.getvalue().splitlines()], ['line 3', 'line 4', 'line 5'])
+
+
+class CartRevisionTests(TestCase):
+    """The cart ETag and `?since=` delta must follow product edits, not only cart writes."""
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product = Product.objects.create(title='Lamp', price=Decimal('10.00'))
+        self.client.post('/add/', {'session_id': 'shopper', 'slug': self.product.slug}, content_type='application/json')
+        self.cart = self.client.get('/cart/', {'session_id': 'shopper'})
+
+    def reprice(self):
+        self.product.price = Decimal('12.50')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+
+    def test_unchanged_cart_is_not_modified(self):
+        response = self.client.get('/cart/', {'session_id': 'shopper'}, HTTP_IF_NONE_MATCH=self.cart['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_price_change_invalidates_etag(self):
+        self.reprice()
+        response = self.client.get('/cart/', {'session_id': 'shopper'}, HTTP_IF_NONE_MATCH=self.cart['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], self.cart['ETag'])
+        self.assertEqual(response.json()['total_price'], '12.50')
+
+    def test_price_change_sends_full_cart_since_old_revision(self):
+        since = self.cart.json()['revision']
+        unchanged = self.client.get('/cart/', {'session_id': 'shopper', 'since': since}).json()
+        self.assertEqual(unchanged['cartitem'], [])
+
+        self.reprice()
+        data = self.client.get('/cart/', {'session_id': 'shopper', 'since': since}).json()
+        self.assertNotIn('removed', data)
+        self.assertEqual([item['product']['price'] for item in data['cartitem']], ['12.50'])
+        self.assertEqual(data['total_price'], '12.50')
+
+
+class CartConcurrencyTests(TransactionTestCase):
+    """Parallel writes to one shopper's cart or ship, each thread on its own connection."""
+
+    threads = 8
+
+    def run_threads(self, target):
+        barrier = threading.Barrier(self.threads)
+        errors = []
+
+        def run():
+            try:
+                barrier.wait()
+                target()
+            except Exception as error:
+                errors.append(error)
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=run) for _ in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_parallel_adds_are_not_lost(self):
+        product = Product.objects.create(title='Concurrency check', price=Decimal('1.00'))
+        cart = Cart.objects.create(session_id='concurrency')
+        adds = 25
+
+        def add():
+            for _ in range(adds):
+                upsert_cart_item(cart, product, 1)
+
+        self.run_threads(add)
+        self.assertEqual(CartItem.objects.get(cart=cart, product=product).quantity, self.threads * adds)
+
+    def test_first_adds_share_one_cart(self):
+        product = Product.objects.create(title='Concurrency check', price=Decimal('1.00'))
+
+        def add():
+            upsert_cart_item(Shopper(None, 'fresh').cart, product, 1)
+
+        self.run_threads(add)
+        cart = Cart.objects.get(session_id='fresh', paid=False)
+        self.assertEqual(CartItem.objects.get(cart=cart, product=product).quantity, self.threads)
+
+    def test_first_addresses_share_one_ship(self):
+        def add():
+            Shipping.objects.create(ship=Shopper(None, 'fresh').ship, name='address')
+
+        self.run_threads(add)
+        ship = Ship.objects.get(session_id='fresh')
+        self.assertEqual(ship.shippings.count(), self.threads)
+
+    def test_parallel_batches_add_one_new_item(self):
+        product = Product.objects.create(title='Concurrency check', price=Decimal('1.00'))
+        cart = Cart.objects.create(session_id='concurrency')
+
+        def batch():
+            apply_cart_ops(cart, [(product.slug, 'add', 1)])
+
+        self.run_threads(batch)
+        self.assertEqual(CartItem.objects.get(cart=cart, product=product).quantity, self.threads)
@@ -3,9 +3,17 @@ from . import views
 
 urlpatterns = [
     path('product/', views.products, name='product'),
+    path('product/batch/', views.productbatch, name='productbatch'),
+    path('product/facets/', views.productfacets, name='productfacets'),
+    path('product/export/', views.productexport, name='productexport'),
+    path('product/suggest/', views.productsuggest, name='productsuggest'),
     path('product/<slug:slug>', views.product, name='productslug'),
+    path('product/<slug:slug>/related/', views.productrelated, name='productrelated'),
+    path('cachestats/', views.cachestats, name='cachestats'),
+    path('country/', views.country, name='country'),
     path('cart/', views.cartitem, name='cartitem'),
     path('add/', views.cartadd, name='cartadd'),
+    path('cart/batch/', views.cartbatch, name='cartbatch'),
     path('remove/', views.cartremove, name='cartremove'),
     path('delete/', views.cartdelete, name='cartdelete'),
     path('clear/', views.cartclear, name='cartclear'),
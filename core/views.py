@@ -2,16 +2,31 @@ from django.shortcuts import render, get_object_or_404
 from django.contrib.auth.hashers import make_password
 from rest_framework.decorators import api_view, permission_classes
 from django.views.decorators.csrf import csrf_exempt
-from rest_framework.permissions import IsAuthenticated
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_GET
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.http import parse_etags, quote_etag
+from rest_framework.utils.encoders import JSONEncoder
+import json
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 from .models import Product, Cart, CartItem, TransactionFlutter, TransactionPaystack, Shipping, Country, Ship, Order
-from .serializer import ProductSerializer, CartItemSerializer, CartSerializer, ShippingSerializer, UserSignUpSerializer, ShipSerializer
+from .serializer import ProductSerializer, ProductFacetSerializer, product_values, CartItemSerializer, CartSerializer, BufferedCartSerializer, CartDeltaSerializer, ShippingSerializer, UserSignUpSerializer, ShipSerializer
 import uuid
 from decimal import Decimal
+from django.db.models import Count, Max, Min, prefetch_related_objects
 from django.conf import settings
 import requests
 from rest_framework import status
 from .filters import SearchProductFilter
+from .pagination import ProductCursorPagination
+from .search import ProductSearchPagination, search_products
+from .suggest import title_index
+from .shopper import get_shopper
+from .carts import CartOpsError, apply_cart_ops, cancel_pending_payments, cart_changes, decrement_cart_item, parse_cart_ops, parse_since, remove_cart_items, resolve_products, upsert_cart_item
+from .cartstore import discard_guest_cart
+from .cache import catalog_etag, catalog_last_modified, catalog_state, product_cache
+from .countries import country_table
 from django.conf import settings
 
 from django.contrib.auth import get_user_model
@@ -25,135 +40,292 @@ def signup(request):
         return Response({'message':'user created'})
     return Response({'error':serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
 
+@condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified)
 @api_view(['GET'])
 def products(request):
+    version, _ = catalog_state(request)
+    key = ('products', request.build_absolute_uri())
+    data = product_cache.get(version, key)
+    if data is not None:
+        return Response(data)
+
     qs = Product.objects.all()
 
-    # Filter by category
+    # Filter by category; an exact choice match can use the category index
     category = request.GET.get('category')
     if category:
-        qs = qs.filter(category__icontains=category)
+        if category.upper() in dict(Product.CATEGORY_CHOICES):
+            qs = qs.filter(category=category.upper())
+        else:
+            qs = qs.filter(category__icontains=category)
 
-    # Search by title
+    # Search title, description and category through the full-text index
     search = request.GET.get('search')
     if search:
-        qs = qs.filter(title__icontains=search)
+        qs = search_products(qs, search)
+        paginator = ProductSearchPagination()
+    else:
+        paginator = ProductCursorPagination()
 
-    serializer = ProductSerializer(qs, many=True)
-    return Response(serializer.data)
+    # Plain rows instead of model instances; the keyset columns ride along
+    page = paginator.paginate_queryset(product_values.values(qs, *paginator.ordering), request)
+    response = paginator.get_paginated_response(product_values.render(page))
+    product_cache.set(version, key, response.data)
+    return response
 
+@condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified)
 @api_view(['GET'])
 def product(request, slug):
-    product = get_object_or_404(Product, slug=slug)
-    serializer = ProductSerializer(product)
-    return Response(serializer.data)
-
+    version, _ = catalog_state(request)
+    key = ('product', slug)
+    data = product_cache.get(version, key)
+    if data is None:
+        product = get_object_or_404(Product, slug=slug)
+        data = ProductSerializer(product).data
+        product_cache.set(version, key, data)
+    return Response(data)
+
+@condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified)
+@api_view(['GET', 'POST'])
+def productbatch(request):
+    slugs = request.data.get('slugs') if request.method == 'POST' else request.GET.get('slugs')
+    if isinstance(slugs, str):
+        slugs = slugs.split(',')
+    if not isinstance(slugs, list) or not all(isinstance(slug, str) for slug in slugs):
+        return Response({'error': 'slugs must be a list or a comma separated string'}, status=status.HTTP_400_BAD_REQUEST)
+
+    slugs = list(dict.fromkeys(slug.strip() for slug in slugs if slug.strip()))
+    if not slugs:
+        return Response({'error': 'slugs is required'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(slugs) > settings.PRODUCT_BATCH_MAX_SLUGS:
+        return Response({'error': f'at most {settings.PRODUCT_BATCH_MAX_SLUGS} slugs per request'}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Same cache entries as the single product view, one query for the misses
+    version, _ = catalog_state(request)
+    found = {slug: product_cache.get(version, ('product', slug)) for slug in slugs}
+    misses = [slug for slug, data in found.items() if data is None]
+    if misses:
+        for data in product_values.render(product_values.values(Product.objects.filter(slug__in=misses))):
+            found[data['slug']] = data
+            product_cache.set(version, ('product', data['slug']), data)
+
+    return Response({
+        'products': {slug: data for slug, data in found.items() if data is not None},
+        'missing': [slug for slug, data in found.items() if data is None],
+    })
+
+@condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified)
 @api_view(['GET'])
-def cartitem(request):
-    user = request.user if request.user.is_authenticated else None
-    session_id = request.GET.get('session_id')
+def productrelated(request, slug):
+    version, _ = catalog_state(request)
+    key = ('related', slug)
+    data = product_cache.get(version, key)
+    if data is not None:
+        return Response(data)
+
+    # Read from the pairs table that build_product_pairs maintains
+    companions = Product.objects.filter(bought_with__product__slug=slug).order_by('-bought_with__count', '-id')
+    data = product_values.render(product_values.values(companions)[:settings.RELATED_PRODUCTS_LIMIT])
+    if not data and not Product.objects.filter(slug=slug).exists():
+        return Response({'error': 'product not found'}, status=status.HTTP_404_NOT_FOUND)
+    product_cache.set(version, key, data)
+    return Response(data)
+
+@condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified)
+@api_view(['GET'])
+def productfacets(request):
+    version, _ = catalog_state(request)
+    key = ('facets', request.GET.urlencode())
+    data = product_cache.get(version, key)
+    if data is not None:
+        return Response(data)
+
+    filterset = SearchProductFilter(request.GET, queryset=Product.objects.all())
+    if not filterset.is_valid():
+        return Response({'error': filterset.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+    # One grouped aggregate for every category at once
+    rows = filterset.qs.order_by().values('category').annotate(
+        count=Count('id'),
+        min_price=Min('price'),
+        max_price=Max('price'),
+    )
+    by_category = {row['category']: row for row in rows}
+
+    facets = []
+    for value, label in Product.CATEGORY_CHOICES:
+        row = by_category.get(value, {})
+        facets.append({
+            'category': value,
+            'label': label,
+            'count': row.get('count', 0),
+            'min_price': row.get('min_price'),
+            'max_price': row.get('max_price'),
+        })
+
+    data = ProductFacetSerializer(facets, many=True).data
+    product_cache.set(version, key, data)
+    return Response(data)
 
+@api_view(['GET'])
+def productsuggest(request):
     try:
-        if user:
-            cart, _ = Cart.objects.get_or_create(user=user, session_id=None, paid=False)
-        else:
-            if not session_id:
-                return Response({'message': 'session_id is not provided'})
-            cart, _ = Cart.objects.get_or_create(user=None, session_id=session_id, paid=False)
-    except Cart.DoesNotExist():
-        return Response({'error':'cart does not exist'})
-    
-    serializer = CartSerializer(cart)
-    return Response(serializer.data)
+        limit = min(max(int(request.GET.get('limit', settings.SUGGEST_LIMIT)), 1), settings.SUGGEST_MAX_LIMIT)
+    except ValueError:
+        limit = settings.SUGGEST_LIMIT
+    return Response(title_index.suggest(request.GET.get('q', ''), limit))
+
+# Plain Django view: DRF's Response cannot stream, and DRF reserves ?format=.
+@require_GET
+def productexport(request):
+    fmt = request.GET.get('format', 'ndjson')
+    if fmt not in ('ndjson', 'json'):
+        return JsonResponse({'error': 'format must be ndjson or json'}, status=400)
+
+    products = product_values.values(Product.objects.order_by('id')).iterator(chunk_size=settings.PRODUCT_EXPORT_CHUNK_SIZE)
+    rows = (json.dumps(product_values.to_representation(product), cls=JSONEncoder) for product in products)
+
+    if fmt == 'json':
+        return StreamingHttpResponse(stream_json_array(rows), content_type='application/json')
+    return StreamingHttpResponse((row + '\n' for row in rows), content_type='application/x-ndjson')
+
+def stream_json_array(rows):
+    yield '['
+    for index, row in enumerate(rows):
+        yield row if index == 0 else ',' + row
+    yield ']'
+
+# Plain Django view: the body is rendered once per country table version
+# and served as is.
+@require_GET
+@cache_control(public=True, max_age=settings.COUNTRY_CACHE_MAX_AGE, immutable=True)
+@condition(etag_func=lambda request: country_table.get().etag)
+def country(request):
+    return HttpResponse(country_table.get().body, content_type='application/json')
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def cachestats(request):
+    return Response(product_cache.stats())
+
+@api_view(['GET'])
+def cartitem(request):
+    shopper = get_shopper(request)
+    if not shopper.identified:
+        return Response({'message': 'session_id is not provided'})
+
+    # Buffered guest carts and carts not created yet have no revision, and
+    # are always sent in full.
+    if shopper.guest_cart or not shopper.stored_cart:
+        cart = shopper.guest_cart.as_cart() if shopper.guest_cart else shopper.cart_with_items
+        return Response(BufferedCartSerializer(cart).data)
+
+    cart = shopper.stored_cart
+    cart.catalog_version, _ = catalog_state(request)
+    etag = quote_etag(cart.revision_tag)
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+    since = parse_since(cart, request.query_params.get('since'))
+    if since is not None:
+        serializer = CartDeltaSerializer(cart_changes(cart, since))
+    else:
+        serializer = CartSerializer(shopper.cart_with_items)
+    return Response(serializer.data, headers={'ETag': etag})
 
 @api_view(['POST'])
 def cartadd(request):
-    user = request.user if request.user.is_authenticated else None
-    session_id = request.data.get('session_id')
     slug = request.data.get('slug')
     quantity = int(request.data.get('quantity', 1))
     action = request.data.get('action', '')
 
-    try:
-        if user:
-            cart, _ = Cart.objects.get_or_create(user=user, session_id=None, paid=False)
-        else:
-            if not session_id:
-                return Response({'message': 'session_id is not provided'})
-            cart, _ = Cart.objects.get_or_create(user=None, session_id=session_id, paid=False)
-    except Cart.DoesNotExist():
-        return Response({'error':'cart does not exist'})
+    shopper = get_shopper(request)
+    if not shopper.identified:
+        return Response({'message': 'session_id is not provided'})
 
     product = get_object_or_404(Product, slug=slug)
-    cartitem, created = CartItem.objects.get_or_create(
-        cart=cart,
-        product=product,
-        defaults={'quantity': quantity}
-    )
+    if action and quantity < 1:
+        if shopper.guest_cart:
+            shopper.guest_cart.apply([(product.pk, 'delete', 0)])
+        elif shopper.stored_cart:
+            remove_cart_items(shopper.stored_cart, [product.pk])
+            cancel_pending_payments(shopper.stored_cart)
+        return Response({'message':'cartitem deleted'})
+    if quantity < 1:
+        return Response({'error': 'quantity must be positive'}, status=status.HTTP_400_BAD_REQUEST)
+
+    if shopper.guest_cart:
+        shopper.guest_cart.apply([(product.pk, 'set' if action else 'add', quantity)])
+        cartitem = shopper.guest_cart.item(product)
+    else:
+        # One INSERT ... ON CONFLICT statement, safe against double clicks
+        cartitem = upsert_cart_item(shopper.cart, product, quantity, replace=bool(action))
+        cancel_pending_payments(shopper.cart)
 
-    if not created:
-        if action:
-            cartitem.quantity = quantity
-        else:
-            cartitem.quantity += quantity
-        cartitem.save()
-        
     serializer = CartItemSerializer(cartitem)
     return Response(serializer.data)
 
+@api_view(['POST'])
+def cartbatch(request):
+    shopper = get_shopper(request)
+    if not shopper.identified:
+        return Response({'message': 'session_id is not provided'})
+
+    try:
+        ops = parse_cart_ops(request.data.get('ops'))
+        # Unknown slugs fail the batch before shopper.cart creates a cart
+        products = resolve_products([slug for slug, _, _ in ops])
+        if shopper.guest_cart:
+            shopper.guest_cart.apply([(products[slug], op, quantity) for slug, op, quantity in ops])
+        else:
+            apply_cart_ops(shopper.cart, ops, products)
+    except CartOpsError as error:
+        data = {'error': error.message}
+        if error.missing:
+            data['missing'] = error.missing
+        return Response(data, status=status.HTTP_400_BAD_REQUEST)
+
+    if shopper.guest_cart:
+        cart = shopper.guest_cart.as_cart()
+    else:
+        shopper.cart_changed()
+        cart = shopper.cart_with_items
+    serializer = CartSerializer(cart) if cart.pk else BufferedCartSerializer(cart)
+    return Response(serializer.data)
+
 @api_view(['POST'])
 def cartremove(request):
-    user = request.user if request.user.is_authenticated else None
-    session_id = request.data.get('session_id')
     slug = request.data.get('slug')
     quantity = int(request.data.get('quantity', 1))
 
-    try:
-        if user:
-            cart, _ = Cart.objects.get_or_create(user=user, session_id=None, paid=False)
-        else:
-            if not session_id:
-                return Response({'message': 'session_id is not provided'})
-            cart, _ = Cart.objects.get_or_create(user=None, session_id=session_id, paid=False)
-    except Cart.DoesNotExist():
-        return Response({'error':'cart does not exist'})
+    shopper = get_shopper(request)
+    if not shopper.identified:
+        return Response({'message': 'session_id is not provided'})
 
     product = get_object_or_404(Product, slug=slug)
-    cartitem = CartItem.objects.get(
-        cart=cart,
-        product=product,
-    )
-
-    if cartitem.quantity:
-        if cartitem.quantity > 1:
-            cartitem.quantity -= quantity
-            cartitem.save()
-        else:
-            cartitem.delete()
-    else:
-        cartitem.delete()
+    if shopper.guest_cart:
+        shopper.guest_cart.apply([(product.pk, 'remove', max(quantity, 1))])
+    elif shopper.stored_cart:
+        decrement_cart_item(shopper.stored_cart, product, max(quantity, 1))
+        cancel_pending_payments(shopper.stored_cart)
 
     return Response({'message':'cartitem updated'})
 
 @api_view(['POST'])
 def cartdelete(request):
-    user = request.user if request.user.is_authenticated else None
-    session_id = request.data.get('session_id')
     slug = request.data.get('slug')
 
-    try:
-        if user:
-            cart, _ = Cart.objects.get_or_create(user=user, session_id=None, paid=False)
-        else:
-            if not session_id:
-                return Response({'message': 'session_id is not provided'})
-            cart, _ = Cart.objects.get_or_create(user=None, session_id=session_id, paid=False)
-    except Cart.DoesNotExist():
-        return Response({'error':'cart does not exist'})
+    shopper = get_shopper(request)
+    if not shopper.identified:
+        return Response({'message': 'session_id is not provided'})
 
     product = get_object_or_404(Product, slug=slug)
-    cartitem = CartItem.objects.get(
-        cart=cart,
+    if shopper.guest_cart:
+        shopper.guest_cart.apply([(product.pk, 'delete', 0)])
+        return Response({'message':'cartitem deleted'})
+    cartitem = get_object_or_404(
+        CartItem,
+        cart=shopper.stored_cart,
         product=product,
     )
     cartitem.delete()
@@ -162,73 +334,51 @@ def cartdelete(request):
 
 @api_view(['POST'])
 def cartclear(request):
-    user = request.user if request.user.is_authenticated else None
-    session_id = request.data.get('session_id')
-
-    try:
-        if user:
-            cart, _ = Cart.objects.get_or_create(user=user, session_id=None, paid=False)
-        else:
-            if not session_id:
-                return Response({'message': 'session_id is not provided'})
-            cart, _ = Cart.objects.get_or_create(user=None, session_id=session_id, paid=False)
-    except Cart.DoesNotExist():
-        return Response({'error':'cart does not exist'})
-
-    cartitem = CartItem.objects.filter(
-        cart=cart,
-    )
-    cartitem.delete()
+    shopper = get_shopper(request)
+    if not shopper.identified:
+        return Response({'message': 'session_id is not provided'})
+
+    if shopper.guest_cart:
+        shopper.guest_cart.apply([(product_id, 'delete', 0) for product_id in shopper.guest_cart.quantities])
+        return Response({'message':'all cartitem deleted'})
+    if shopper.stored_cart:
+        remove_cart_items(shopper.stored_cart)
     
     return Response({'message':'all cartitem deleted'})
 
 @api_view(['GET'])
 def orderitem(request):
-    user = request.user if request.user.is_authenticated else None
-    session_id = request.GET.get('session_id')
+    shopper = get_shopper(request)
+    if not shopper.identified:
+        return Response({'message': 'session_id is not provided'})
+
+    cart = Cart.objects.filter(**shopper.owner, paid=True).with_totals()
 
-    if user:
-        cart = Cart.objects.filter(user=user, session_id=None, paid=True)
-    else:
-        if not session_id:
-            return Response({'message': 'session_id is not provided'})
-        cart = Cart.objects.filter(user=None, session_id=session_id, paid=True)
-    
     serializer = CartSerializer(cart, many=True)
     return Response(serializer.data)
 
 
 @api_view(['GET'])
 def ship(request):
-    user = request.user if request.user.is_authenticated else None
-    session_id = request.GET.get('session_id')
+    shopper = get_shopper(request)
+    if not shopper.identified:
+        return Response({'message': 'session_id is not provided'})
+
+    ship = shopper.stored_ship
+    if ship is None:
+        # Nothing is stored until the first address is added.
+        return Response({'id': None, 'shippings': []})
 
-    try:
-        if user:
-            ship, _ = Ship.objects.get_or_create(user=user, session_id=None)
-        else:
-            if not session_id:
-                return Response({'message': 'session_id is not provided'})
-            ship, _ = Ship.objects.get_or_create(user=None, session_id=session_id)
-    except Ship.DoesNotExist():
-        return Response({'error':'ship does not exist'})
-    
     serializer = ShipSerializer(ship)
     return Response(serializer.data)
 
 @api_view(['GET'])
 def shippingcurrent(request):
-    user = request.user if request.user.is_authenticated else None
-    session_id = request.GET.get('session_id')
+    shopper = get_shopper(request)
+    if not shopper.identified:
+        return Response({'error': 'session_id is required'}, status=400)
 
-    if user:
-        ship, _ = Ship.objects.get_or_create(user=user, session_id=None)
-    else:
-        if not session_id:
-            return Response({'error': 'session_id is required'}, status=400)
-        ship, _ = Ship.objects.get_or_create(user=None, session_id=session_id)
-
-    shipping = Shipping.objects.filter(ship=ship, selected=True).first()
+    shipping = shopper.shipping
 
     if not shipping:
         return Response({'message': 'No selected shipping found'}, status=404)
@@ -238,18 +388,13 @@ def shippingcurrent(request):
 
 @api_view(['GET'])
 def shippingid(request):
-    user = request.user if request.user.is_authenticated else None
-    session_id = request.GET.get('session_id')
     shipping_id = request.GET.get('shipping_id')
 
-    if user:
-        ship, _ = Ship.objects.get_or_create(user=user, session_id=None)
-    else:
-        if not session_id:
-            return Response({'error': 'session_id is required'}, status=400)
-        ship, _ = Ship.objects.get_or_create(user=None, session_id=session_id)
+    shopper = get_shopper(request)
+    if not shopper.identified:
+        return Response({'error': 'session_id is required'}, status=400)
 
-    shipping = Shipping.objects.get(ship=ship, id=shipping_id)
+    shipping = shopper.find_shipping(shipping_id)
 
     if not shipping:
         return Response({'message': 'No selected shipping found'}, status=404)
@@ -259,28 +404,21 @@ def shippingid(request):
 
 @api_view(['POST'])
 def shipping(request):
-    user = request.user if request.user.is_authenticated else None
-    session_id = request.data.get('session_id')
     serializer = ShippingSerializer(data=request.data)
 
     if serializer.is_valid():
-        if user:
-            ship, _ = Ship.objects.get_or_create(user=user, session_id=None)
-        else:
-            if not session_id:
-                return Response({'error': 'session_id is required'}, status=400)
-            ship, _ = Ship.objects.get_or_create(user=None, session_id=session_id)
+        shopper = get_shopper(request)
+        if not shopper.identified:
+            return Response({'error': 'session_id is required'}, status=400)
+        ship = shopper.ship
 
-        shipping = Shipping.objects.create(
-            ship=ship,
-            **serializer.validated_data 
-        )
         default = str(request.data.get("default")).lower() == "true"
 
+        # A single save, which also settles the other addresses' flags
+        fields = {**serializer.validated_data, 'selected': True}
         if default:
-            shipping.default = True
-        shipping.selected = True
-        shipping.save()
+            fields['default'] = True
+        shipping = Shipping.objects.create(ship=ship, **fields)
 
         return Response(ShippingSerializer(shipping).data, status=201)
     
@@ -288,23 +426,17 @@ def shipping(request):
 
 @api_view(['PUT', 'PATCH'])
 def shippingupdate(request):
-    user = request.user if request.user.is_authenticated else None
     shipping_id = request.data.get('shipping_id')
-    session_id = request.data.get('session_id')
 
     if not shipping_id:
         return Response({'error': 'shipping_id is required'}, status=400)
 
-    if user:
-        ship, _ = Ship.objects.get_or_create(user=user, session_id=None)
-    else:
-        if not session_id:
-            return Response({'error': 'session_id is required'}, status=400)
-        ship, _ = Ship.objects.get_or_create(user=None, session_id=session_id)
+    shopper = get_shopper(request)
+    if not shopper.identified:
+        return Response({'error': 'session_id is required'}, status=400)
 
-    try:
-        shipping = Shipping.objects.get(id=shipping_id, ship=ship)
-    except Shipping.DoesNotExist:
+    shipping = shopper.find_shipping(shipping_id)
+    if shipping is None:
         return Response({'error': 'Shipping not found'}, status=404)
 
     serializer = ShippingSerializer(shipping, data=request.data, partial=True)
@@ -317,30 +449,24 @@ def shippingupdate(request):
 
 @api_view(['PUT', 'PATCH'])
 def shippingtrue(request):
-    user = request.user if request.user.is_authenticated else None
-    session_id = request.data.get('session_id')
     shipping_id = request.data.get('shipping_id')
     default = request.data.get('default')
 
     if not shipping_id:
         return Response({'error': 'shipping_id is required'}, status=400)
 
-    if user:
-        ship, _ = Ship.objects.get_or_create(user=user, session_id=None)
-    else:
-        if not session_id:
-            return Response({'error': 'session_id is required'}, status=400)
-        ship, _ = Ship.objects.get_or_create(user=None, session_id=session_id)
+    shopper = get_shopper(request)
+    if not shopper.identified:
+        return Response({'error': 'session_id is required'}, status=400)
 
-    try:
-        shipping = Shipping.objects.get(id=shipping_id, ship=ship)
-        if default:
-            shipping.default = True
-        else:
-            shipping.selected = True
-        shipping.save()
-    except Shipping.DoesNotExist:
+    shipping = shopper.find_shipping(shipping_id)
+    if shipping is None:
         return Response({'error': 'Shipping not found'}, status=404)
+    if default:
+        shipping.default = True
+    else:
+        shipping.selected = True
+    shipping.save()
 
     serializer = ShippingSerializer(shipping)
     return Response(serializer.data, status=200)
@@ -348,27 +474,27 @@ def shippingtrue(request):
 
 @api_view(['POST'])
 def flutter(request):
-    user = request.user if request.user.is_authenticated else None
-    session_id = request.data.get('session_id')
-
     tx_ref = str(uuid.uuid4())
     currency = 'NGN'
     redirect_url = 'https://cezugwu.github.io/zentro/#/pending'
     tax = Decimal('4.00')
 
-    if user:
-        cart, _ = Cart.objects.get_or_create(user=user, session_id=None, paid=False)
-        ship, _ = Ship.objects.get_or_create(user=user, session_id=None)
-    else:
-        if not session_id:
-            return Response({'error': 'session_id is required'}, status=status.HTTP_400_BAD_REQUEST)
-        cart, _ = Cart.objects.get_or_create(user=None, session_id=session_id, paid=False)
-        ship, _ = Ship.objects.get_or_create(user=None, session_id=session_id)
+    shopper = get_shopper(request)
+    if not shopper.identified:
+        return Response({'error': 'session_id is required'}, status=status.HTTP_400_BAD_REQUEST)
+    if shopper.guest_cart:
+        # Checkout prices what is in the database, so write the buffer first
+        shopper.guest_cart.flush()
+    shipping = shopper.shipping
+    if not shipping:
+        return Response({'error': 'no shipping address selected'}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Checking out writes, so this creates the cart if there is none yet
+    shopper.cart
+    cart = shopper.cart_with_items
 
     amount = sum([(item.quantity * item.product.price) for item in cart.cartitem.all()])
     total_amount = amount + tax
-
-    shipping = Shipping.objects.get(ship=ship, selected=True)
     
     customer = {}
     customer = {'email': f'{shipping.email if shipping.email else ''}', 'name': f'{shipping.name if shipping.name else ''}'} 
@@ -408,6 +534,8 @@ def flutter(request):
                 currency=currency,
                 amount=total_amount,
             )
+            # The cart's payment link changed
+            Cart.objects.next_revision(cart.pk)
 
     except requests.RequestException as e:
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -449,6 +577,9 @@ def verify_and_create_order(tx_ref, transaction_id):
         cart = transaction.cart
         cart.paid = True
         cart.save(update_fields=['paid'])
+        prefetch_related_objects([cart], 'cartitem__product')
+        if cart.user is None:
+            discard_guest_cart(cart.session_id)
 
         # ✅ Get shipping info
         if cart.user:
@@ -551,7 +682,7 @@ def paystack(request):
         currency = 'NGN'
 
         user = get_object_or_404(User, username=username)
-        cart = get_object_or_404(Cart, user=user, paid=False)
+        cart = get_object_or_404(Cart.objects.prefetch_related('cartitem__product'), user=user, paid=False)
         total = sum([(item.quantity * item.product.price) for item in cart.cartitem.all()])
         tax = Decimal('4.00')
         amount = total + tax